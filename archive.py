@@ -0,0 +1,422 @@
+"""
+archive.py - Escrita do pacote de extração direto no arquivo compactado
+Todo o trabalho de compressão acontece num trabalhador único por pacote (uma thread própria ou,
+com processo=True, um dos processos de empacotamento, iniciados uma vez com o bot); o loop de
+eventos apenas enfileira as entradas (na ordem em que devem aparecer) e aguarda.
+Com `limite_bytes`, o pacote é dividido em volumes que cabem no limite de upload:
+cada grupo de entradas (ex.: um tópico e seus anexos) fica inteiro num único volume
+e todo volume leva um indice.json com o próprio conteúdo e a lista de volumes.
+Formatos: zip-deflate, zip-lzma, tar.xz e tar.gz (FORMATS), cada um com seu nível.
+"""
+import io
+import os
+import json
+import lzma
+import zlib
+import uuid
+import shutil
+import asyncio
+import tarfile
+import zipfile
+from datetime import datetime
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+COPY_CHUNK = 1024 * 1024
+INDEX_FILENAME = "indice.json"
+INDEX_RESERVE = 4096  # Espaço fixo reservado em cada volume para o índice e o diretório central
+
+# formato -> (extensão, nível padrão, níveis aceitos)
+FORMATS = {
+    "zip-deflate": (".zip", 6, range(0, 10)),
+    "zip-lzma": (".zip", None, ()),  # O zipfile sempre usa o preset padrão do LZMA: não há nível
+    "tar.xz": (".tar.xz", 6, range(0, 10)),
+    "tar.gz": (".tar.gz", 6, range(0, 10)),
+}
+DEFAULT_FORMAT = "zip-deflate"
+
+
+def normalizar_formato(formato: str, nivel=None) -> tuple:
+    """(formato, nível) válidos: formato desconhecido -> zip-deflate; nível inválido -> padrão do formato"""
+    if formato not in FORMATS: formato = DEFAULT_FORMAT
+    _, padrao, aceitos = FORMATS[formato]
+    try:
+        nivel = int(nivel) if nivel is not None else padrao
+    except (TypeError, ValueError):
+        nivel = padrao
+    return formato, (nivel if nivel in aceitos else padrao)
+
+def _entry_overhead(arcname: str) -> int:
+    """Cabeçalho local + diretório central + extras zip64 + linha no índice (estimativa folgada)"""
+    return 3 * len(arcname.encode("utf-8")) + 200
+
+def _source_size(source) -> int:
+    if isinstance(source, (bytes, bytearray)): return len(source)
+    if isinstance(source, str): return os.path.getsize(source)
+    if hasattr(source, "size"): return source.size()
+    pos = source.tell()
+    size = source.seek(0, os.SEEK_END)
+    source.seek(pos)
+    return size
+
+def _open_source(source):
+    """Arquivo de leitura para a origem (quem chama fecha)"""
+    if isinstance(source, (bytes, bytearray)): return io.BytesIO(source)
+    if isinstance(source, str): return open(source, "rb")
+    if hasattr(source, "open"): return source.open()
+    source.seek(0)
+    return source
+
+
+# --- FORMATOS ---
+
+class _ZipContainer:
+    def __init__(self, path: str, formato: str, nivel):
+        compression = zipfile.ZIP_LZMA if formato == "zip-lzma" else zipfile.ZIP_DEFLATED
+        self.zf = zipfile.ZipFile(path, "w", compression=compression, compresslevel=nivel)
+
+    def write(self, arcname: str, source, size: int) -> None:
+        src = _open_source(source)
+        try:
+            with self.zf.open(arcname, "w", force_zip64=True) as dst:
+                shutil.copyfileobj(src, dst, COPY_CHUNK)
+        finally:
+            src.close()
+
+    def size(self) -> int:
+        # Cada entrada é finalizada ao ser fechada: a posição do arquivo é o tamanho real
+        return self.zf.fp.tell()
+
+    def sync(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.zf.close()
+
+
+class _MultiStreamWriter:
+    """
+    Arquivo de escrita que comprime em gzip/xz e encerra o fluxo atual sob demanda.
+    O resultado são membros/fluxos concatenados (lidos normalmente por gzip, xz e tarfile),
+    o que permite medir o tamanho comprimido real sem reiniciar o compressor a cada entrada.
+    """
+
+    def __init__(self, path: str, formato: str, nivel: int):
+        self.raw = open(path, "wb")
+        self.formato = formato
+        self.nivel = nivel
+        self.pendente = 0  # Bytes entregues ao compressor desde o último encerramento de fluxo
+        self._comp = self._novo()
+
+    def _novo(self):
+        if self.formato == "tar.xz":
+            return lzma.LZMACompressor(format=lzma.FORMAT_XZ, preset=self.nivel)
+        return zlib.compressobj(self.nivel, zlib.DEFLATED, 31)  # wbits 31: cabeçalho gzip
+
+    def write(self, data) -> int:
+        self.raw.write(self._comp.compress(data))
+        self.pendente += len(data)
+        return len(data)
+
+    def encerrar_fluxo(self) -> None:
+        if not self.pendente: return
+        self.raw.write(self._comp.flush())
+        self._comp = self._novo()
+        self.pendente = 0
+
+    def close(self) -> None:
+        self.encerrar_fluxo()
+        self.raw.close()
+
+
+class _TarContainer:
+    def __init__(self, path: str, formato: str, nivel):
+        self.stream = _MultiStreamWriter(path, formato, nivel)
+        self.tf = tarfile.open(fileobj=self.stream, mode="w|", format=tarfile.PAX_FORMAT)
+
+    def write(self, arcname: str, source, size: int) -> None:
+        info = tarfile.TarInfo(arcname)
+        info.size = size
+        info.mtime = int(datetime.now().timestamp())
+        src = _open_source(source)
+        try:
+            self.tf.addfile(info, src)
+        finally:
+            src.close()
+
+    def size(self) -> int:
+        # Limite superior: o que ainda está no compressor conta como se não comprimisse
+        return self.stream.raw.tell() + self.stream.pendente + 64
+
+    def sync(self) -> None:
+        self.stream.encerrar_fluxo()
+
+    def close(self) -> None:
+        self.tf.close()
+        self.stream.close()
+
+
+class _Volume:
+    def __init__(self, path: str, container):
+        self.path = path
+        self.container = container
+        self.entries = []   # {"nome", "tamanho"}
+        self.topicos = {}   # thread_id -> entrada do TOON
+        self.reserve = INDEX_RESERVE if isinstance(container, _ZipContainer) else INDEX_RESERVE + tarfile.RECORDSIZE
+        self.closed = False
+
+    def size(self) -> int:
+        return self.container.size()
+
+    def fits(self, extra: int, limite: int) -> bool:
+        if self.size() + self.reserve + extra <= limite: return True
+        # Estimativa estourou: encerra o fluxo comprimido (tar) e mede de novo
+        self.container.sync()
+        return self.size() + self.reserve + extra <= limite
+
+    def close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self.container.close()
+
+
+class _Pacote:
+    """Estado do pacote (volumes abertos): vive na thread ou no processo de empacotamento"""
+
+    def __init__(self, path: str, formato: str, nivel, limite_bytes: int = None):
+        self.path = path
+        self.formato = formato
+        self.nivel = nivel
+        self.ext = FORMATS[formato][0]
+        self.limite_bytes = limite_bytes
+        self.volumes = []
+
+    def _volume_path(self, n: int) -> str:
+        return f"{self.path[:-len(self.ext)]}_parte{n}{self.ext}"
+
+    def _new_volume(self) -> _Volume:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        path = self._volume_path(len(self.volumes) + 1)
+        container = (_ZipContainer if self.ext == ".zip" else _TarContainer)(path, self.formato, self.nivel)
+        vol = _Volume(path, container)
+        self.volumes.append(vol)
+        return vol
+
+    def _volume_for(self, estimate: int) -> _Volume:
+        vol = self.volumes[-1] if self.volumes else self._new_volume()
+        if self.limite_bytes and vol.entries and not vol.fits(estimate, self.limite_bytes):
+            # Volumes ficam abertos até o fim: o índice (com o total de volumes) é escrito no fechamento
+            vol = self._new_volume()
+        return vol
+
+    def add_group(self, entries: list, topico) -> int:
+        """Escreve o grupo num único volume; retorna o número do volume (1, 2, ...)"""
+        sizes = [_source_size(src) for _, src in entries]
+        vol = self._volume_for(sum(s + _entry_overhead(name) for (name, _), s in zip(entries, sizes)))
+        for (name, src), size in zip(entries, sizes):
+            vol.container.write(name, src, size)
+            vol.entries.append({"nome": name, "tamanho": size})
+            # Diretório central e linha do índice desta entrada só são escritos no fechamento
+            vol.reserve += _entry_overhead(name) - (30 + len(name.encode("utf-8")))
+        if topico is not None:
+            vol.topicos[str(topico)] = entries[0][0]
+        if self.limite_bytes and not vol.fits(0, self.limite_bytes):
+            print(f"⚠️ {os.path.basename(vol.path)}: grupo de {sum(sizes)} bytes não cabe no limite de {self.limite_bytes} bytes.")
+        return len(self.volumes)
+
+    def finish(self) -> list:
+        vols = [v for v in self.volumes if v.entries]
+        # Volume único mantém o nome original do pacote
+        nomes = [os.path.basename(self.path)] if len(vols) == 1 else [os.path.basename(v.path) for v in vols]
+        for i, v in enumerate(vols, 1):
+            indice = {
+                "pacote": os.path.basename(self.path),
+                "formato": self.formato, "nivel": self.nivel,
+                "gerado_em": datetime.now().astimezone().isoformat(),
+                "volume": i, "total": len(vols), "volumes": nomes,
+                "topicos": v.topicos, "entradas": v.entries,
+            }
+            data = json.dumps(indice, ensure_ascii=False, indent=2).encode("utf-8")
+            v.container.write(INDEX_FILENAME, data, len(data))
+        for v in self.volumes:
+            v.close()
+            if not v.entries and os.path.exists(v.path): os.remove(v.path)
+        if len(vols) == 1:
+            os.replace(vols[0].path, self.path)
+            vols[0].path = self.path
+        self.volumes = vols
+        return [v.path for v in vols]
+
+    def discard(self) -> None:
+        for v in self.volumes:
+            try:
+                v.close()
+            except Exception:
+                pass
+            if os.path.exists(v.path): os.remove(v.path)
+        self.volumes = []
+
+
+# --- PROCESSOS DE EMPACOTAMENTO ---
+# Iniciados uma vez (main.py) e reaproveitados por todos os pacotes: cada processo tem um único
+# trabalhador, então as chamadas de um pacote chegam sempre ao mesmo processo, em ordem, e o
+# estado do pacote (_PACOTES) vive nele.
+
+_PACOTES = {}     # No processo de empacotamento: id -> _Pacote
+_PROCESSOS = []   # No processo do bot: [executor, pacotes abertos]
+
+def _novo_processo() -> ProcessPoolExecutor:
+    # spawn: o processo do bot tem threads (I/O, SQLite) e fork com threads não é seguro
+    executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    executor.submit(os.getpid)  # Sobe o processo agora, e não no primeiro pacote
+    return executor
+
+def iniciar_processos(n: int) -> None:
+    """Sobe `n` processos de empacotamento (no início do bot; sem isso, o primeiro pacote sobe um)"""
+    while len(_PROCESSOS) < max(1, n):
+        _PROCESSOS.append([_novo_processo(), 0])
+
+def encerrar_processos() -> None:
+    """Encerra os processos de empacotamento (no desligamento do bot)"""
+    while _PROCESSOS:
+        executor, _ = _PROCESSOS.pop()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def _reservar_processo() -> list:
+    """O processo com menos pacotes abertos"""
+    if not _PROCESSOS: iniciar_processos(1)
+    slot = min(_PROCESSOS, key=lambda p: p[1])
+    slot[1] += 1
+    return slot
+
+def _liberar_processo(slot: list) -> None:
+    slot[1] -= 1
+
+def _no_processo(pacote_id: str, abrir: tuple, metodo: str, args: tuple):
+    """
+    Ponto de entrada no processo de empacotamento (funções de módulo atravessam o pickle).
+    Toda chamada leva os parâmetros de abertura: o pacote é criado na primeira que chegar,
+    e uma falha nela volta para quem chamou.
+    """
+    pacote = _PACOTES.get(pacote_id)
+    if pacote is None:
+        if metodo == "discard": return None
+        pacote = _PACOTES[pacote_id] = _Pacote(*abrir)
+    try:
+        return getattr(pacote, metodo)(*args)
+    finally:
+        if metodo in ("finish", "discard"): _PACOTES.pop(pacote_id, None)
+
+
+class ArchiveWriter:
+    """
+    Um pacote (ou vários volumes) escrito por um único trabalhador: ZipFile/TarFile não admitem
+    escritas simultâneas. Com processo=True o trabalhador é um dos processos de empacotamento
+    (a compressão e a renderização dos TOON não disputam o GIL com o loop do gateway); as origens
+    precisam então atravessar o pickle: bytes, caminhos ou objetos com size()/open()
+    (ex.: toon.ToonHistorico).
+    """
+
+    def __init__(self, path: str, limite_bytes: int = None, formato: str = DEFAULT_FORMAT, nivel: int = None,
+                 processo: bool = False):
+        """`path` sem extensão: ela vem do formato"""
+        self.formato, self.nivel = normalizar_formato(formato, nivel)
+        self.ext = FORMATS[self.formato][0]
+        self.path = os.path.abspath(path) + self.ext
+        self.limite_bytes = limite_bytes
+        self.names = set()
+        self._where = {}  # entrada -> número do volume (1, 2, ...)
+        self._paths = []  # Caminhos dos volumes, após close
+        self._liberado = False  # Trabalhador devolvido (close/abort): nada mais é enviado
+        if processo:
+            self._pacote = None
+            self._id = uuid.uuid4().hex
+            self._aberto = False  # Alguma chamada já foi enviada ao processo
+            self._processo = _reservar_processo()
+        else:
+            self._pacote = _Pacote(self.path, self.formato, self.nivel, limite_bytes)
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="amanda-zip")
+
+    async def _submit(self, metodo: str, *args):
+        loop = asyncio.get_running_loop()
+        if self._pacote is not None:
+            return await loop.run_in_executor(self._executor, getattr(self._pacote, metodo), *args)
+        self._aberto = True
+        abrir = (self.path, self.formato, self.nivel, self.limite_bytes)
+        executor = self._processo[0]
+        try:
+            return await loop.run_in_executor(executor, _no_processo, self._id, abrir, metodo, args)
+        except BrokenProcessPool:
+            # Processo morto: os pacotes abertos nele se perdem, os próximos vão para um novo
+            if self._processo[0] is executor: self._processo[0] = _novo_processo()
+            raise
+
+    def _liberar(self) -> None:
+        if self._liberado: return
+        self._liberado = True
+        if self._pacote is not None:
+            self._executor.shutdown(wait=False)
+        else:
+            _liberar_processo(self._processo)
+
+    def unique_name(self, arcname: str) -> str:
+        """Evita entradas duplicadas (ex.: dois tópicos com o mesmo nome limpo)"""
+        if arcname not in self.names: return arcname
+        base, ext = os.path.splitext(arcname)
+        n = 2
+        while f"{base}_{n}{ext}" in self.names: n += 1
+        return f"{base}_{n}{ext}"
+
+    # --- API (loop de eventos) ---
+
+    async def add_group(self, entries: list, topico=None) -> list:
+        """
+        Adiciona entradas [(nome, origem)] que devem ficar no mesmo volume.
+        origem: bytes, caminho de arquivo, objeto com size()/open() ou arquivo aberto
+        (fechado após a cópia; só sem processo).
+        """
+        entries = list(entries)
+        for i, (name, src) in enumerate(entries):
+            name = self.unique_name(name)
+            self.names.add(name)
+            entries[i] = (name, src)
+        volume = await self._submit("add_group", entries, topico)
+        for name, _ in entries:
+            self._where[name] = volume
+        return [name for name, _ in entries]
+
+    async def add_fileobj(self, arcname: str, fileobj) -> str:
+        return (await self.add_group([(arcname, fileobj)]))[0]
+
+    async def add_file(self, arcname: str, path: str) -> str:
+        return (await self.add_group([(arcname, path)]))[0]
+
+    async def add_bytes(self, arcname: str, data: bytes) -> str:
+        return (await self.add_group([(arcname, data)]))[0]
+
+    def volume_index(self, arcname: str) -> int:
+        """Número (1, 2, ...) do volume que contém a entrada"""
+        return self._where.get(arcname)
+
+    def volume_of(self, arcname: str) -> str:
+        """Nome do arquivo do volume que contém a entrada (após close)"""
+        n = self._where.get(arcname)
+        return os.path.basename(self._paths[n - 1]) if n else None
+
+    async def close(self) -> list:
+        """Finaliza o pacote e retorna os caminhos dos volumes, em ordem (vazio se nada foi escrito)"""
+        try:
+            if self._pacote is None and not self._aberto: return []
+            self._paths = await self._submit("finish")
+            return self._paths
+        finally:
+            self._liberar()
+
+    async def abort(self) -> None:
+        """Descarta o pacote (erro ou cancelamento); espera a escrita em andamento terminar"""
+        try:
+            if self._liberado or (self._pacote is None and not self._aberto): return
+            await self._submit("discard")
+        finally:
+            self._liberar()
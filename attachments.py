@@ -0,0 +1,232 @@
+"""
+attachments.py - Espelhamento dos anexos dos tópicos (as URLs do CDN do Discord expiram)
+Estrutura: ./dados_servidores/{guild_id}/anexos/blobs/{sha256}{.ext}
+Cada conteúdo é guardado uma única vez (endereçado pelo hash); o índice
+attachment_id -> blob e o registro de quais blobs já foram enviados ficam no
+backend de registros (coleções "anexos" e "blobs").
+Downloads concorrentes (limitados), gravados em blocos direto no disco, com teto por
+arquivo e por execução. A sessão HTTP é recebida de fora (a mesma da extração), o que
+também permite apontar o espelhamento para um servidor HTTP local.
+"""
+import os
+import re
+import json
+import hashlib
+import asyncio
+import aiohttp
+
+ATTACHMENTS_DIRNAME = "anexos"
+BLOBS_DIRNAME = "blobs"
+MANIFEST_FILENAME = "manifesto.json"
+CHUNK_SIZE = 64 * 1024
+
+
+class _LimiteExcedido(Exception):
+    pass
+
+
+def nome_seguro(filename: str) -> str:
+    """Nome de arquivo sem separadores de caminho nem caracteres problemáticos (mantém a extensão)"""
+    nome = re.sub(r"[^\w.\-]", "_", os.path.basename(filename or "")).strip("._")
+    return nome[:100] or "arquivo"
+
+def nome_blob(digest: str, filename: str) -> str:
+    """Hash do conteúdo + extensão original (mantém a identificação IMAGEM/ARQUIVO do TOON)"""
+    ext = os.path.splitext(nome_seguro(filename))[1].lower()[:10]
+    return digest + ext
+
+
+class BlobStore:
+    """Blobs de um servidor + índice no backend de registros (chamadas síncronas: usar no executor)"""
+
+    def __init__(self, pasta_base: str, backend, guild_id: str):
+        self.pasta = os.path.join(pasta_base, BLOBS_DIRNAME)
+        self.backend = backend
+        self.guild_id = str(guild_id)
+
+    def caminho(self, blob: str) -> str:
+        return os.path.join(self.pasta, blob)
+
+    def buscar(self, attachment_id) -> dict:
+        """Entrada do índice do anexo, apenas se o blob ainda existir no disco"""
+        entry = self.backend.get_item(self.guild_id, "anexos", str(attachment_id))
+        return entry if entry and os.path.exists(self.caminho(entry["blob"])) else None
+
+    def guardar(self, parcial: str, blob: str) -> bool:
+        """Move o download para o blob; se o conteúdo já existia, descarta a cópia. True se é novo."""
+        destino = self.caminho(blob)
+        if os.path.exists(destino):
+            os.remove(parcial)
+            return False
+        os.makedirs(self.pasta, exist_ok=True)
+        os.replace(parcial, destino)
+        return True
+
+    def registrar(self, attachment_id, blob: str, tamanho: int, nome: str, thread_id) -> None:
+        self.backend.upsert(self.guild_id, "anexos", {
+            "attachment_id": str(attachment_id), "blob": blob, "tamanho": tamanho,
+            "nome": nome, "thread_id": str(thread_id)
+        })
+        if not self.backend.get_item(self.guild_id, "blobs", blob):
+            self.backend.upsert(self.guild_id, "blobs", {"blob": blob, "tamanho": tamanho, "enviado_em": None, "arquivo": None})
+
+    def anexos_dos_topicos(self, thread_ids) -> dict:
+        """thread_id -> entradas do índice (uma leitura do índice inteiro)"""
+        ids = {str(t) for t in thread_ids}
+        por_topico = {}
+        for entry in self.backend.get(self.guild_id, "anexos", []):
+            if entry.get("thread_id") in ids:
+                por_topico.setdefault(entry["thread_id"], []).append(entry)
+        return por_topico
+
+    def situacao(self, blobs) -> dict:
+        """blob -> registro de envio (enviado_em/arquivo)"""
+        return {b: (self.backend.get_item(self.guild_id, "blobs", b) or {"blob": b}) for b in blobs}
+
+    def marcar_enviados(self, blobs, arquivo: str, quando: str) -> None:
+        for b in blobs:
+            entry = self.backend.get_item(self.guild_id, "blobs", b) or {"blob": b}
+            entry.update({"enviado_em": quando, "arquivo": arquivo})
+            self.backend.upsert(self.guild_id, "blobs", entry)
+
+
+class AttachmentMirror:
+    """Uma instância por execução de extração: o teto de bytes e as estatísticas são da execução"""
+
+    def __init__(self, session: aiohttp.ClientSession, store: BlobStore,
+                 max_file_bytes: int, max_run_bytes: int, concurrency: int = 4, run_io=None):
+        self.session = session
+        self.store = store
+        self.max_file_bytes = max_file_bytes
+        self.max_run_bytes = max_run_bytes
+        self._run_io = run_io
+        self._sem = asyncio.Semaphore(max(1, concurrency))
+        self._bytes_execucao = 0
+        self.stats = {"baixados": 0, "reaproveitados": 0, "duplicados": 0, "ignorados": 0, "falhas": 0, "bytes": 0}
+        self.blobs_por_topico = {}  # thread_id -> blobs referenciados nesta execução
+
+    async def _io(self, func, *args):
+        if self._run_io is None: return func(*args)
+        return await self._run_io(func, *args)
+
+    async def baixar(self, thread_id, attachment_id, filename: str, url: str, size: int = None) -> str:
+        """
+        Garante o blob do anexo e retorna o nome dele (hash + extensão).
+        None se o anexo passou dos limites ou o download falhou (quem chama mantém a URL).
+        """
+        blob = await self._baixar(thread_id, attachment_id, filename, url, size)
+        if blob: self.blobs_por_topico.setdefault(str(thread_id), set()).add(blob)
+        return blob
+
+    async def _baixar(self, thread_id, attachment_id, filename: str, url: str, size: int = None) -> str:
+        entry = await self._io(self.store.buscar, attachment_id)
+        if entry:
+            self.stats["reaproveitados"] += 1
+            return entry["blob"]
+        if size and size > self.max_file_bytes:
+            self.stats["ignorados"] += 1
+            return None
+
+        async with self._sem:
+            if self._bytes_execucao >= self.max_run_bytes:
+                self.stats["ignorados"] += 1
+                return None
+            os.makedirs(self.store.pasta, exist_ok=True)
+            parcial = os.path.join(self.store.pasta, f".{attachment_id}.part")
+            baixados = 0
+            ok = False
+            try:
+                digest = hashlib.sha256()
+                async with self.session.get(url) as r:
+                    if r.status != 200:
+                        self.stats["falhas"] += 1
+                        return None
+                    if r.content_length and r.content_length > self.max_file_bytes:
+                        self.stats["ignorados"] += 1
+                        return None
+                    with open(parcial, "wb") as f:
+                        async for chunk in r.content.iter_chunked(CHUNK_SIZE):
+                            baixados += len(chunk)
+                            self._bytes_execucao += len(chunk)
+                            if baixados > self.max_file_bytes or self._bytes_execucao > self.max_run_bytes:
+                                raise _LimiteExcedido()
+                            f.write(chunk)
+                            digest.update(chunk)
+                blob = nome_blob(digest.hexdigest(), filename)
+                novo = await self._io(self.store.guardar, parcial, blob)
+                await self._io(self.store.registrar, attachment_id, blob, baixados, nome_seguro(filename), thread_id)
+                ok = True
+                self.stats["baixados" if novo else "duplicados"] += 1
+                if novo: self.stats["bytes"] += baixados
+                return blob
+            except _LimiteExcedido:
+                self.stats["ignorados"] += 1
+                return None
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                print(f"⚠️ Falha ao baixar anexo {attachment_id}: {e}")
+                self.stats["falhas"] += 1
+                return None
+            finally:
+                if not ok:
+                    # Bytes de downloads abortados não contam para o teto da execução
+                    self._bytes_execucao -= baixados
+                    if os.path.exists(parcial): os.remove(parcial)
+
+
+class SelecaoAnexos:
+    """
+    Decide, tópico a tópico, quais blobs entram no pacote: os referenciados pelo tópico
+    que ainda não foram enviados em pacotes anteriores (todos, com incluir_todos) e que
+    ainda não entraram neste. Construção síncrona (lê o índice uma vez): usar no executor.
+    """
+
+    def __init__(self, store: BlobStore, thread_ids, incluir_todos=False):
+        self.store = store
+        self.incluir_todos = incluir_todos
+        self.por_topico = {tid: {e["blob"] for e in entries}
+                           for tid, entries in store.anexos_dos_topicos(thread_ids).items()}
+        conhecidos = {b for blobs in self.por_topico.values() for b in blobs}
+        self.enviados = set() if incluir_todos else {
+            b for b, entry in store.situacao(conhecidos).items() if entry.get("enviado_em")}
+        self.incluidos = []
+        self._incluidos_set = set()
+
+    def novos_do_topico(self, thread_id, extras=()) -> list:
+        """Blobs a empacotar junto com o tópico (extras: baixados nesta execução)"""
+        blobs = sorted(self.por_topico.get(str(thread_id), set()) | set(extras))
+        novos = [b for b in blobs if b not in self.enviados and b not in self._incluidos_set
+                 and os.path.exists(self.store.caminho(b))]
+        self.incluidos.extend(novos)
+        self._incluidos_set.update(novos)
+        return novos
+
+def montar_manifesto(store: BlobStore, thread_ids, incluidos, volumes: dict = None) -> dict:
+    """
+    Manifesto dos anexos dos tópicos extraídos: onde está cada blob (neste pacote, e em qual
+    volume, ou no pacote anterior em que foi enviado). Síncrono: usar no executor.
+    """
+    por_topico = store.anexos_dos_topicos(thread_ids)
+    blobs = sorted({e["blob"] for entries in por_topico.values() for e in entries})
+    if not blobs: return None
+    situacao = store.situacao(blobs)
+    incluidos_set = set(incluidos)
+    volumes = volumes or {}
+    return {
+        "anexos": {
+            b: {
+                "tamanho": int(situacao[b]["tamanho"]) if situacao[b].get("tamanho") is not None else None,
+                "neste_pacote": b in incluidos_set,
+                "volume": volumes.get(b),
+                # Para blobs já enviados: em qual pacote anterior está o conteúdo
+                "enviado_em": None if b in incluidos_set else situacao[b].get("enviado_em"),
+                "arquivo": None if b in incluidos_set else situacao[b].get("arquivo"),
+            } for b in blobs
+        },
+        "topicos": {
+            tid: [{"attachment_id": e["attachment_id"], "nome": e.get("nome"), "blob": e["blob"]} for e in entries]
+            for tid, entries in por_topico.items()
+        },
+    }
+
+def manifesto_bytes(manifesto: dict) -> bytes:
+    return json.dumps(manifesto, ensure_ascii=False, indent=2).encode("utf-8")
@@ -0,0 +1,241 @@
+"""
+audit_log.py - Log de auditoria append-only (JSONL) por servidor
+Estrutura: ./dados_servidores/{guild_id}/logs/
+    atual.jsonl                    (segmento ativo, uma entrada JSON por linha)
+    log_20251216_151013.jsonl.gz   (segmentos antigos, comprimidos)
+Cada evento custa uma única escrita de linha, feita por uma thread dedicada.
+Durabilidade (LOG_FSYNC): "lote" (padrão) faz o fsync do segmento sempre que a fila esvazia,
+ou seja, uma rajada de eventos custa um fsync só, e uma queda perde no máximo os eventos
+ainda na fila; "evento" faz o fsync a cada linha, como o logs.json antigo.
+"""
+import os
+import gzip
+import json
+import queue
+import collections
+import shutil
+import threading
+import time
+from datetime import datetime
+
+LOG_DIRNAME = "logs"
+ACTIVE_SEGMENT = "atual.jsonl"
+SEGMENT_MAX_BYTES = int(os.getenv("LOG_SEGMENT_MAX_BYTES", str(1024 * 1024)))   # 1 MiB
+SEGMENT_MAX_AGE = float(os.getenv("LOG_SEGMENT_MAX_AGE", str(24 * 3600)))       # 1 dia
+MAX_SEGMENTS = int(os.getenv("LOG_MAX_SEGMENTS", "30"))                         # Retenção de segmentos comprimidos
+FSYNC_POR_EVENTO = os.getenv("LOG_FSYNC", "lote") == "evento"
+READ_BLOCK = 64 * 1024
+
+
+class _Segment:
+    """Segmento ativo aberto em modo append"""
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.path = os.path.join(folder, ACTIVE_SEGMENT)
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.size = self.file.tell()
+        # A idade do segmento conta a partir da sua criação (ou do mtime, se já existia)
+        self.started = os.path.getmtime(self.path) if self.size else time.time()
+        self.pendente = False  # Escrito desde o último fsync
+
+    def write(self, line: str) -> None:
+        self.file.write(line)
+        self.file.flush()
+        self.size += len(line.encode("utf-8"))
+        self.pendente = True
+        if FSYNC_POR_EVENTO: self.sync()
+
+    def sync(self) -> None:
+        if not self.pendente: return
+        os.fsync(self.file.fileno())
+        self.pendente = False
+
+    def should_rotate(self) -> bool:
+        if not self.size: return False
+        return self.size >= SEGMENT_MAX_BYTES or (time.time() - self.started) >= SEGMENT_MAX_AGE
+
+    def close(self) -> None:
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+
+class AuditLogWriter:
+    """Thread única que recebe eventos por fila e os anexa ao segmento do servidor"""
+
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._segments = {}
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self) -> None:
+        if self._thread and self._thread.is_alive(): return
+        with self._start_lock:
+            if self._thread and self._thread.is_alive(): return
+            self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+            self._thread.start()
+
+    def append(self, log_folder: str, entry: dict) -> None:
+        """Enfileira o evento (não bloqueia: a escrita acontece na thread do log)"""
+        self._ensure_started()
+        self._queue.put(("append", log_folder, entry))
+
+    def flush(self, timeout: float = 10.0) -> None:
+        """Bloqueia até que todos os eventos enfileirados tenham sido escritos (e sincronizados)"""
+        if not self._thread or not self._thread.is_alive(): return
+        done = threading.Event()
+        self._queue.put(("flush", None, done))
+        done.wait(timeout)
+
+    def close(self) -> None:
+        """Escreve o que estiver pendente e fecha os segmentos (usar no desligamento)"""
+        if not self._thread or not self._thread.is_alive(): return
+        self._queue.put(("close", None, None))
+        self._thread.join(timeout=10.0)
+
+    def _run(self) -> None:
+        while True:
+            op, folder, payload = self._queue.get()
+            try:
+                if op == "append":
+                    self._write(folder, payload)
+                    if self._queue.empty(): self._sync()
+                elif op == "flush":
+                    self._sync()
+                    payload.set()
+                elif op == "close":
+                    for seg in self._segments.values(): seg.close()
+                    self._segments.clear()
+                    return
+            except Exception as e:
+                print(f"❌ Erro no log de auditoria ({folder}): {e}")
+
+    def _sync(self) -> None:
+        for seg in self._segments.values():
+            try:
+                seg.sync()
+            except OSError as e:
+                print(f"❌ Erro no fsync do log de auditoria ({seg.folder}): {e}")
+
+    def _write(self, folder: str, entry: dict) -> None:
+        seg = self._segments.get(folder)
+        if seg is None:
+            importar_logs_json(os.path.dirname(folder))
+            os.makedirs(folder, exist_ok=True)
+            seg = self._segments[folder] = _Segment(folder)
+        if seg.should_rotate():
+            seg = self._rotate(folder, seg)
+        seg.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def _rotate(self, folder: str, seg: _Segment) -> _Segment:
+        seg.close()
+        stamp = datetime.fromtimestamp(seg.started).strftime("%Y%m%d_%H%M%S")
+        destino = os.path.join(folder, f"log_{stamp}.jsonl.gz")
+        n = 1
+        while os.path.exists(destino):
+            destino = os.path.join(folder, f"log_{stamp}_{n}.jsonl.gz"); n += 1
+        with open(seg.path, "rb") as src, gzip.open(destino, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(seg.path)
+        # Retenção: descarta os segmentos comprimidos mais antigos
+        for antigo in list_segments(folder)[MAX_SEGMENTS:]:
+            try: os.remove(antigo)
+            except OSError: pass
+        novo = self._segments[folder] = _Segment(folder)
+        return novo
+
+
+_WRITER = AuditLogWriter()
+
+def append(log_folder: str, entry: dict) -> None:
+    _WRITER.append(log_folder, entry)
+
+def flush() -> None:
+    _WRITER.flush()
+
+def close() -> None:
+    _WRITER.close()
+
+# --- LEITURA ---
+
+def list_segments(log_folder: str) -> list:
+    """Segmentos comprimidos, do mais novo para o mais antigo"""
+    if not os.path.isdir(log_folder): return []
+    nomes = [n for n in os.listdir(log_folder) if n.startswith("log_") and n.endswith(".jsonl.gz")]
+    nomes.sort(reverse=True)
+    return [os.path.join(log_folder, n) for n in nomes]
+
+def _read_lines_reversed(path: str):
+    """Linhas do segmento ativo, da última para a primeira, lendo blocos a partir do fim"""
+    try:
+        f = open(path, "rb")
+    except OSError:
+        return
+    with f:
+        pos = f.seek(0, os.SEEK_END)
+        resto = b""
+        while pos > 0:
+            n = min(READ_BLOCK, pos)
+            pos -= n
+            f.seek(pos)
+            partes = (f.read(n) + resto).split(b"\n")
+            resto = partes[0]  # Pode continuar no bloco anterior
+            for line in reversed(partes[1:]):
+                yield line.decode("utf-8", errors="replace")
+        yield resto.decode("utf-8", errors="replace")
+
+def _read_gz_entries_reversed(path: str, limit: int = None) -> list:
+    """Entradas de um segmento comprimido, da última para a primeira (só as `limit` últimas ficam na memória)"""
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            entries = collections.deque((e for e in map(_parse, f) if e is not None), maxlen=limit)
+    except OSError:
+        return []
+    entries.reverse()
+    return entries
+
+def _parse(line: str):
+    line = line.strip()
+    if not line: return None
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError:
+        return None  # Linha truncada (ex.: queda durante a escrita)
+
+def iter_recent(log_folder: str, limit: int = None):
+    """
+    Itera as entradas do log da mais recente para a mais antiga.
+    Os segmentos só são abertos (e descomprimidos) conforme a iteração avança.
+    """
+    count = 0
+    fontes = [os.path.join(log_folder, ACTIVE_SEGMENT)] + list_segments(log_folder)
+    for path in fontes:
+        if not os.path.exists(path): continue
+        if path.endswith(".gz"):
+            entries = _read_gz_entries_reversed(path, None if limit is None else limit - count)
+        else:
+            entries = (e for e in map(_parse, _read_lines_reversed(path)) if e is not None)
+        for entry in entries:
+            yield entry
+            count += 1
+            if limit is not None and count >= limit: return
+
+# --- MIGRAÇÃO ---
+
+def importar_logs_json(guild_folder: str) -> int:
+    """Converte o antigo logs.json do servidor para o segmento ativo (uma única vez)"""
+    legado = os.path.join(guild_folder, "logs.json")
+    log_folder = os.path.join(guild_folder, LOG_DIRNAME)
+    if not os.path.exists(legado) or os.path.isdir(log_folder): return 0
+    try:
+        with open(legado, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return 0
+    os.makedirs(log_folder, exist_ok=True)
+    with open(os.path.join(log_folder, ACTIVE_SEGMENT), "a", encoding="utf-8") as f:
+        for e in entries if isinstance(entries, list) else []:
+            f.write(json.dumps(e, ensure_ascii=False) + "\n")
+    os.replace(legado, legado + ".migrado")
+    return len(entries)
@@ -0,0 +1,99 @@
+"""
+bench_archive.py - Benchmark dos formatos de pacote (zip-deflate, zip-lzma, tar.xz, tar.gz)
+Gera um corpus TOON sintético (tópicos com mensagens em português, menções e links do CDN)
+e mede, para cada formato e nível, a razão de compressão e a vazão de escrita (MB/s de
+entrada), usando o mesmo ArchiveWriter da extração.
+
+Uso:
+    python bench_archive.py                                  # todos os formatos, níveis 1/6/9
+    python bench_archive.py --formatos tar.xz zip-deflate --niveis 1 9 --topicos 500
+    python bench_archive.py --processo                       # inclui o custo de enviar ao processo (já iniciado)
+"""
+import os
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+
+import archive
+import toon
+
+PALAVRAS = (
+    "processo pedido parecer prazo secretaria orgao documento anexo protocolo resposta "
+    "solicitacao analise contrato aditivo empenho nota fiscal pagamento pendencia "
+    "aprovado reaberto categoria setor equipe reuniao ajuste relatorio planilha"
+).split()
+AUTORES = [f"usuario_{i}" for i in range(40)]
+
+
+def gerar_topico(rng: random.Random, n_mensagens: int) -> bytes:
+    """Um tópico no mesmo formato TOON gravado pela extração"""
+    contexto = {"topico": f"Tópico {rng.randint(1, 10**6)}", "categoria": rng.choice(PALAVRAS), "orgao": rng.choice(PALAVRAS)}
+    linhas = []
+    for _ in range(n_mensagens):
+        texto = " ".join(rng.choice(PALAVRAS) for _ in range(rng.randint(3, 40)))
+        if rng.random() < 0.1:
+            texto += f" <@{rng.randint(10**17, 10**18)}>"
+        anexos = []
+        if rng.random() < 0.05:
+            anexos.append(f"https://cdn.discordapp.com/attachments/{rng.randint(10**17, 10**18)}/{rng.randint(10**17, 10**18)}/doc.pdf")
+        linhas.append(toon.formatar_linha(rng.choice(AUTORES), texto, anexos))
+    return toon.cabecalho(contexto, len(linhas)) + "\n".join(linhas).encode("utf-8")
+
+def gerar_corpus(topicos: int, mensagens: int, seed: int) -> list:
+    rng = random.Random(seed)
+    return [gerar_topico(rng, rng.randint(1, 2 * mensagens)) for _ in range(topicos)]
+
+async def _escrever(corpus: list, base: str, formato: str, nivel, processo: bool) -> list:
+    pacote = archive.ArchiveWriter(base, formato=formato, nivel=nivel, processo=processo)
+    for i, data in enumerate(corpus):
+        await pacote.add_group([(f"topico_{i}.toon", data)], topico=i)
+    return await pacote.close()
+
+def bench(corpus: list, formato: str, nivel, processo: bool = False) -> dict:
+    pasta = tempfile.mkdtemp(prefix="bench_archive_")
+    try:
+        inicio = time.perf_counter()
+        volumes = asyncio.run(_escrever(corpus, os.path.join(pasta, "pacote"), formato, nivel, processo))
+        total = time.perf_counter() - inicio
+        entrada = sum(len(d) for d in corpus)
+        saida = sum(os.path.getsize(v) for v in volumes)
+        return {
+            "nivel": archive.normalizar_formato(formato, nivel)[1],
+            "entrada_mb": entrada / 1024**2, "saida_mb": saida / 1024**2,
+            "razao": entrada / saida if saida else 0.0,
+            "mb_s": entrada / 1024**2 / total if total else 0.0,
+        }
+    finally:
+        shutil.rmtree(pasta, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dos formatos de pacote")
+    parser.add_argument("--formatos", nargs="+", default=list(archive.FORMATS), choices=list(archive.FORMATS))
+    parser.add_argument("--niveis", nargs="+", type=int, default=[1, 6, 9])
+    parser.add_argument("--topicos", type=int, default=300)
+    parser.add_argument("--mensagens", type=int, default=150, help="Média de mensagens por tópico")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--processo", action="store_true", help="Empacota num processo separado, como na extração")
+    args = parser.parse_args()
+
+    corpus = gerar_corpus(args.topicos, args.mensagens, args.seed)
+    print(f"Corpus: {len(corpus)} tópicos, {sum(len(d) for d in corpus) / 1024**2:.1f} MB\n")
+    print(f"{'formato':<12} {'nível':>5} {'entrada MB':>10} {'saída MB':>9} {'razão':>7} {'MB/s':>8}")
+    # Como no bot: o processo de empacotamento sobe uma vez, fora das medições
+    if args.processo: archive.iniciar_processos(1)
+    try:
+        for formato in args.formatos:
+            # Formatos sem nível (zip-lzma) são medidos uma vez só
+            niveis = args.niveis if archive.FORMATS[formato][2] else [None]
+            for nivel in niveis:
+                r = bench(corpus, formato, nivel, args.processo)
+                nivel_txt = "-" if r["nivel"] is None else str(r["nivel"])
+                print(f"{formato:<12} {nivel_txt:>5} {r['entrada_mb']:>10.1f} {r['saida_mb']:>9.2f} {r['razao']:>7.2f} {r['mb_s']:>8.1f}")
+    finally:
+        archive.encerrar_processos()
+
+if __name__ == "__main__":
+    main()
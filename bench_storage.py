@@ -0,0 +1,113 @@
+"""
+bench_storage.py - Benchmark dos backends de armazenamento (JSON, SQLite, memória)
+Mede ops/s e latências (p50/p99) de leitura de config e upsert de resolução com 10, 1k e 100k
+registros pré-existentes. O log de auditoria não passa pelos backends (audit_log.py): é medido
+à parte, como "audit" (append = enfileirar; append_flush = até a linha estar no segmento).
+
+Uso:
+    python bench_storage.py                      # todos os backends e tamanhos
+    python bench_storage.py --backends sqlite json --sizes 10 1000
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+
+import storage
+import audit_log
+
+GUILD = "1"
+DEFAULT_SIZES = (10, 1_000, 100_000)
+MAX_OPS = 2_000        # Limite de operações por medição
+MAX_SECONDS = 3.0      # ...ou de tempo (o backend JSON com 100k é lento de propósito)
+
+CONFIG_DOC = {
+    "setup": {"id_cargo_adm": 1, "id_canal_comandos": 2, "id_canal_countdown": 3, "id_canal_aprovacao": 4},
+    "connected_channels": {str(i): {"last_marker_timestamp": "2025-01-01T00:00:00-03:00"} for i in range(10)},
+    "perms": {"extracao_canal": [], "extracao_tudo": [], "reabrir": [], "resolvido": [], "aprovar": []},
+}
+
+def _resolucao(i: int) -> dict:
+    return {
+        "data": "2025-12-16T13:36:22.069938-03:00", "thread_id": str(10**17 + i), "thread_nome": f"topico {i}",
+        "resolvido_por": "Dev", "resolvido_por_id": "1397639294088384623", "orgao": "aa", "categoria": "bb"
+    }
+
+def _log(i: int) -> dict:
+    return {"timestamp": "2025-12-16T13:36:22-03:00", "acao": "APROVAR", "usuario": "bench", "detalhes": f"evento {i}"}
+
+def _medir(op) -> dict:
+    lat = []
+    inicio = time.perf_counter()
+    i = 0
+    while i < MAX_OPS and time.perf_counter() - inicio < MAX_SECONDS:
+        t0 = time.perf_counter()
+        op(i)
+        lat.append(time.perf_counter() - t0)
+        i += 1
+    total = time.perf_counter() - inicio
+    lat.sort()
+    return {
+        "ops": len(lat),
+        "ops_s": len(lat) / total if total else 0.0,
+        "p50_ms": statistics.median(lat) * 1000,
+        "p99_ms": lat[min(len(lat) - 1, int(len(lat) * 0.99))] * 1000,
+    }
+
+def bench_backend(kind: str, size: int) -> dict:
+    base = tempfile.mkdtemp(prefix=f"bench_{kind}_")
+    backend = storage.create_backend(kind, base)
+    try:
+        # Pré-população
+        backend.put(GUILD, "config", CONFIG_DOC)
+        backend.put(GUILD, "resolucoes", [_resolucao(i) for i in range(size)])
+
+        return {
+            "config_read": _medir(lambda i: backend.get(GUILD, "config", {})),
+            # Metade atualiza registros existentes, metade cria novos
+            "resolution_upsert": _medir(lambda i: backend.upsert(GUILD, "resolucoes", _resolucao(i if i % 2 else size + i))),
+        }
+    finally:
+        backend.close()
+        shutil.rmtree(base, ignore_errors=True)
+
+def bench_audit_log(size: int) -> dict:
+    base = tempfile.mkdtemp(prefix="bench_audit_")
+    folder = os.path.join(base, GUILD, audit_log.LOG_DIRNAME)
+    writer = audit_log.AuditLogWriter()
+    try:
+        # Pré-população: segmento ativo com `size` linhas
+        writer.append(folder, _log(0))
+        writer.flush()
+        for i in range(1, size): writer.append(folder, _log(i))
+        writer.flush()
+
+        def append_flush(i):
+            writer.append(folder, _log(size + i))
+            writer.flush()
+
+        resultado = {"log_append": _medir(lambda i: writer.append(folder, _log(size + i)))}
+        writer.flush()
+        resultado["log_append_flush"] = _medir(append_flush)
+        return resultado
+    finally:
+        writer.close()
+        shutil.rmtree(base, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dos backends de armazenamento")
+    parser.add_argument("--backends", nargs="+", default=list(storage.BACKENDS), choices=list(storage.BACKENDS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=list(DEFAULT_SIZES))
+    args = parser.parse_args()
+
+    print(f"{'backend':<8} {'registros':>9} {'operação':<18} {'ops':>6} {'ops/s':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    medicoes = [(kind, size, lambda k=kind, s=size: bench_backend(k, s)) for kind in args.backends for size in args.sizes]
+    medicoes += [("audit", size, lambda s=size: bench_audit_log(s)) for size in args.sizes]
+    for kind, size, bench in medicoes:
+        for op, r in bench().items():
+            print(f"{kind:<8} {size:>9} {op:<18} {r['ops']:>6} {r['ops_s']:>10.1f} {r['p50_ms']:>9.3f} {r['p99_ms']:>9.3f}")
+
+if __name__ == "__main__":
+    main()
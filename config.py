@@ -5,12 +5,21 @@ import discord
 from discord.ext import commands
 import asyncio
 import os
-import json
 import re
-import tempfile
+import copy
+import contextlib
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import time
 from datetime import datetime, timezone, timedelta
 from dotenv import load_dotenv
 
+import storage
+import audit_log
+import archive
+import attachments
+
 load_dotenv()
 
 # --- CONFIGURAÇÃO GERAL ---
@@ -19,76 +28,450 @@ MINUTO_BACKUP = 59
 BRT_OFFSET = timezone(timedelta(hours=-3))
 BASE_DATA_PATH = "./dados_servidores" # Pasta raiz para todos os dados
 
-# --- LOCKS PARA OPERAÇÕES ASYNC ---
-_GUILD_LOCKS = {}
+# --- EXTRAÇÃO ---
+# Padrões da seção "extracao" do config.json de cada servidor (o servidor pode sobrescrever)
+EXTRACTION_DEFAULTS = {
+    "concorrencia": int(os.getenv("EXTRACTION_CONCURRENCY", "3")),  # Tópicos extraídos em paralelo por servidor
+    # "canais": varre os tópicos arquivados dos canais conectados
+    # "resolucoes": busca por ID apenas as resoluções aprovadas ainda não extraídas
+    "modo": os.getenv("EXTRACTION_MODE", "canais"),
+    # Espelhamento de anexos (as URLs do CDN expiram): desligado por padrão
+    "anexos": os.getenv("EXTRACTION_MIRROR_ATTACHMENTS", "0") == "1",
+    "anexos_concorrencia": int(os.getenv("ATTACHMENT_CONCURRENCY", "4")),  # Downloads simultâneos por execução
+    "anexo_max_mb": float(os.getenv("ATTACHMENT_MAX_MB", "25")),           # Teto por arquivo
+    "anexos_max_mb_execucao": float(os.getenv("ATTACHMENT_RUN_MAX_MB", "500")),  # Teto por execução
+    # Formato do pacote (zip-deflate, zip-lzma, tar.xz, tar.gz) e nível (vazio = padrão do formato)
+    # Mais nível = menos bytes para enviar e mais CPU: medir com bench_archive.py
+    "formato": os.getenv("ARCHIVE_FORMAT", archive.DEFAULT_FORMAT),
+    "nivel": os.getenv("ARCHIVE_LEVEL") or None,
+}
+EXTRACTION_MODES = ("canais", "resolucoes")
+EXTRACTION_MAX_CONCURRENCY = 10  # Teto: cada tópico é um bucket de rate limit, mas o limite global da API é compartilhado
+# Fila de extrações: servidores extraídos ao mesmo tempo (teto global, manuais e agendadas)
+EXTRACTION_GLOBAL_CONCURRENCY = int(os.getenv("EXTRACTION_GLOBAL_CONCURRENCY", os.getenv("DAILY_GUILD_CONCURRENCY", "4")))
+# Backup diário: tempo máximo de execução por servidor (sem contar a espera na fila)
+DAILY_GUILD_TIMEOUT = float(os.getenv("DAILY_GUILD_TIMEOUT", str(30 * 60)))
+# Renderização dos TOON e compressão nos processos de empacotamento (0 = thread, no processo do bot)
+EXTRACTION_PACK_PROCESS = os.getenv("EXTRACTION_PACK_PROCESS", "1") == "1"
+# Processos de empacotamento, iniciados com o bot (cada pacote usa um só, o menos ocupado)
+EXTRACTION_PACK_WORKERS = int(os.getenv("EXTRACTION_PACK_WORKERS", "2"))
+
+# --- CACHE EM MEMÓRIA (config.json / categorias.json) ---
+CACHED_FILES = ("config.json", "categorias.json")
+# Intervalo mínimo (segundos) entre verificações de mtime; dentro dele a leitura não toca o disco
+CACHE_MTIME_CHECK_INTERVAL = float(os.getenv("CACHE_MTIME_CHECK_INTERVAL", "5"))
+_FILE_CACHE = {}  # (guild_id, filename) -> {"data": ..., "mtime": ..., "checked": ..., "dirty": ...}
+
+# --- WRITE-BEHIND (COALESCÊNCIA DE ESCRITAS) ---
+# Política de durabilidade por arquivo:
+#   "debounce": segundos acumulando alterações em memória antes de gravar (0 = grava na hora)
+#   "fsync": força o fsync na gravação (False = confia no cache do SO)
+WRITE_POLICIES = {
+    "config.json": {"debounce": float(os.getenv("CONFIG_WRITE_DEBOUNCE", "1.0")), "fsync": True},
+    "categorias.json": {"debounce": float(os.getenv("CATEGORIAS_WRITE_DEBOUNCE", "1.0")), "fsync": True},
+}
+DEFAULT_WRITE_POLICY = {"debounce": 0.0, "fsync": True}
+_PENDING_FLUSHES = {}  # (guild_id, filename) -> asyncio.Task
+
+# --- BACKENDS DE ARMAZENAMENTO ---
+# Registros (resoluções/pendências): STORAGE_BACKEND (sqlite | json | memory)
+# Documentos (config/categorias): STORAGE_BACKEND_DOCS (padrão json, editável à mão)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", storage.DEFAULT_BACKEND)
+STORAGE_BACKEND_DOCS = os.getenv("STORAGE_BACKEND_DOCS", "json")
+_BACKENDS = {}
+
+def get_backend(name: str = "resolucoes") -> storage.StorageBackend:
+    """Backend responsável pelo dado `name` (criado na primeira chamada)"""
+    kind = STORAGE_BACKEND_DOCS if name in storage.DOCUMENTS else STORAGE_BACKEND
+    if kind not in _BACKENDS:
+        _BACKENDS[kind] = storage.create_backend(kind, BASE_DATA_PATH)
+    return _BACKENDS[kind]
+
+def close_storage() -> None:
+    """Fecha os backends abertos (usar no desligamento)"""
+    for backend in _BACKENDS.values():
+        backend.close()
+    _BACKENDS.clear()
+
+def _doc_name(filename: str) -> str:
+    """'config.json' -> 'config' (nome lógico usado pelos backends)"""
+    return filename[:-5] if filename.endswith(".json") else filename
+
+# --- EXECUTOR DE I/O DEDICADO ---
+IO_WORKERS = int(os.getenv("IO_WORKERS", "4"))
+IO_MAX_PENDING = int(os.getenv("IO_MAX_PENDING", "64"))  # Acima disso, quem submete aguarda (backpressure)
+
+class IOExecutor:
+    """
+    Pool de threads próprio para o I/O de disco do DataManager.
+    Não compete com o executor padrão do loop, limita as tarefas em voo
+    e mede fila e latência de cada tarefa.
+    """
+    def __init__(self, workers: int, max_pending: int, name: str = "amanda-io"):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.name = name
+        self._pool = None
+        self._slots = None
+        self.submitted = 0
+        self.running = 0
+        self._running_lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+        self.backpressure_waits = 0
+        self._queue_waits = collections.deque(maxlen=1000)
+        self._run_times = collections.deque(maxlen=1000)
+
+    @property
+    def pending(self) -> int:
+        return self.submitted - self.completed - self.failed
+
+    def _timed(self, enqueued: float, func, args, kwargs):
+        started = time.monotonic()
+        self._queue_waits.append(started - enqueued)
+        with self._running_lock:
+            self.running += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._running_lock:
+                self.running -= 1
+            self._run_times.append(time.monotonic() - started)
+
+    async def run(self, func, *args, **kwargs):
+        """Executa `func` no pool; aguarda vaga se já houver max_pending tarefas em voo"""
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        if self._slots.locked():
+            self.backpressure_waits += 1
+        async with self._slots:
+            self.submitted += 1
+            loop = asyncio.get_running_loop()
+            try:
+                result = await loop.run_in_executor(self._pool, self._timed, time.monotonic(), func, args, kwargs)
+            except BaseException:
+                self.failed += 1
+                raise
+            self.completed += 1
+            return result
+
+    def metrics(self) -> dict:
+        def _stats(values):
+            vals = sorted(values)
+            if not vals: return {"avg_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+            return {
+                "avg_ms": sum(vals) / len(vals) * 1000,
+                "p99_ms": vals[min(len(vals) - 1, int(len(vals) * 0.99))] * 1000,
+                "max_ms": vals[-1] * 1000
+            }
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "queue_depth": max(0, self.pending - self.running),
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "backpressure_waits": self.backpressure_waits,
+            "queue_wait": _stats(self._queue_waits),
+            "task_latency": _stats(self._run_times)
+        }
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+            self._pool = None
+        self._slots = None
 
-def get_guild_lock(guild_id: str) -> asyncio.Lock:
-    if guild_id not in _GUILD_LOCKS:
-        _GUILD_LOCKS[guild_id] = asyncio.Lock()
-    return _GUILD_LOCKS[guild_id]
+_IO_EXECUTOR = IOExecutor(IO_WORKERS, IO_MAX_PENDING)
+
+# --- LOCKS PARA OPERAÇÕES ASYNC ---
+LOCK_IDLE_TTL = float(os.getenv("LOCK_IDLE_TTL", "600"))   # Locks ociosos há mais que isso são descartados
+LOCK_SWEEP_INTERVAL = 60.0
+_GUILD_LOCKS = {}  # (guild_id, filename) -> RWLock
+_LAST_LOCK_SWEEP = 0.0
+LOCK_METRICS = {
+    "read": {"acquisitions": 0, "contended": 0, "wait_total": 0.0, "wait_max": 0.0},
+    "write": {"acquisitions": 0, "contended": 0, "wait_total": 0.0, "wait_max": 0.0},
+    "evicted": 0
+}
+
+def _record_lock_wait(mode: str, waited: float) -> None:
+    m = LOCK_METRICS[mode]
+    m["acquisitions"] += 1
+    if waited > 0.001: m["contended"] += 1
+    m["wait_total"] += waited
+    m["wait_max"] = max(m["wait_max"], waited)
+
+class RWLock:
+    """
+    Lock leitor/escritor para asyncio: vários leitores OU um escritor.
+    Escritores em espera têm preferência (leitores novos aguardam) para não sofrerem starvation.
+    `async with lock:` equivale a `async with lock.write():`.
+    """
+    def __init__(self):
+        self._cond = asyncio.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+        self._readers_waiting = 0
+        self.last_used = time.monotonic()
+
+    @property
+    def idle(self) -> bool:
+        return not (self._readers or self._writer or self._writers_waiting or self._readers_waiting)
+
+    @contextlib.asynccontextmanager
+    async def read(self):
+        inicio = time.monotonic()
+        async with self._cond:
+            self._readers_waiting += 1
+            try:
+                await self._cond.wait_for(lambda: not self._writer and not self._writers_waiting)
+            finally:
+                self._readers_waiting -= 1
+            self._readers += 1
+        _record_lock_wait("read", time.monotonic() - inicio)
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._readers -= 1
+                self.last_used = time.monotonic()
+                self._cond.notify_all()
+
+    async def acquire_write(self) -> None:
+        inicio = time.monotonic()
+        async with self._cond:
+            self._writers_waiting += 1
+            try:
+                await self._cond.wait_for(lambda: not self._writer and not self._readers)
+            finally:
+                self._writers_waiting -= 1
+            self._writer = True
+        _record_lock_wait("write", time.monotonic() - inicio)
+
+    async def release_write(self) -> None:
+        async with self._cond:
+            self._writer = False
+            self.last_used = time.monotonic()
+            self._cond.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def write(self):
+        await self.acquire_write()
+        try:
+            yield
+        finally:
+            await self.release_write()
+
+    # Sem estado por uso: cada `async with lock:` adquire e libera o próprio lock de escrita
+    async def __aenter__(self):
+        await self.acquire_write()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.release_write()
+
+def get_guild_lock(guild_id: str, filename: str = "*") -> RWLock:
+    """Lock do arquivo `filename` do servidor (escritas em arquivos diferentes não se bloqueiam)"""
+    global _LAST_LOCK_SWEEP
+    now = time.monotonic()
+    if now - _LAST_LOCK_SWEEP > LOCK_SWEEP_INTERVAL:
+        _LAST_LOCK_SWEEP = now
+        for k, l in list(_GUILD_LOCKS.items()):
+            if l.idle and now - l.last_used > LOCK_IDLE_TTL:
+                del _GUILD_LOCKS[k]
+                LOCK_METRICS["evicted"] += 1
+    key = (str(guild_id), filename)
+    lock = _GUILD_LOCKS.get(key)
+    if lock is None:
+        lock = _GUILD_LOCKS[key] = RWLock()
+    lock.last_used = now
+    return lock
+
+def get_lock_metrics() -> dict:
+    """Métricas de espera por locks (contagens e segundos acumulados)"""
+    return {**copy.deepcopy(LOCK_METRICS), "active_locks": len(_GUILD_LOCKS)}
 
 # --- GERENCIAMENTO DE ARQUIVOS (CAMADA DE ISOLAMENTO) ---
 
 class DataManager:
     """Gerenciador que garante que dados do Server A não toquem no Server B"""
+
+    @staticmethod
+    async def run_io(func, *args, **kwargs):
+        """Executa I/O bloqueante no executor dedicado do DataManager"""
+        return await _IO_EXECUTOR.run(func, *args, **kwargs)
+
+    @staticmethod
+    def io_metrics() -> dict:
+        return _IO_EXECUTOR.metrics()
+
+    @staticmethod
+    def shutdown_io(wait: bool = True) -> None:
+        _IO_EXECUTOR.shutdown(wait=wait)
     
     @staticmethod
     def get_path(guild_id: str, filename: str) -> str:
         """Gera o caminho ./dados_servidores/{guild_id}/{filename}"""
         guild_id = str(guild_id)
         folder = os.path.join(BASE_DATA_PATH, guild_id)
-        if not os.path.exists(folder):
-            os.makedirs(folder, exist_ok=True)
+        # Só toca o disco na primeira vez que a pasta é vista neste processo
+        if storage.ensure_folder(folder):
+            register_guild(guild_id)
         return os.path.join(folder, filename)
 
     @staticmethod
     def load_json(guild_id: str, filename: str, default_data: dict) -> dict:
         """Lê JSON de forma síncrona (para uso interno ou getters simples)"""
-        path = DataManager.get_path(guild_id, filename)
-        if not os.path.exists(path):
-            DataManager.save_sync(path, default_data)
-            return default_data
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            print(f"⚠️ Arquivo corrompido detectado: {path}. Retornando padrão.")
-            return default_data
+        if filename in CACHED_FILES:
+            # Cópia profunda: os chamadores modificam o resultado livremente
+            return copy.deepcopy(DataManager._load_cached(str(guild_id), filename, default_data))
+        name = _doc_name(filename)
+        return get_backend(name).get(str(guild_id), name, default_data)
 
     @staticmethod
-    def save_sync(filepath: str, data: dict) -> None:
+    def _load_cached(guild_id: str, filename: str, default_data: dict) -> dict:
         """
-        Escreve JSON de forma ATÔMICA (Safe Write).
-        1. Escreve num arquivo temporário.
-        2. Renomeia para o arquivo final.
+        Retorna o conteúdo cacheado do arquivo.
+        O backend só é consultado (versão/mtime) a cada CACHE_MTIME_CHECK_INTERVAL segundos
+        e só é relido se a versão mudou (edição externa).
         """
-        dir_name = os.path.dirname(filepath)
-        # Cria arquivo temporário na mesma pasta
-        with tempfile.NamedTemporaryFile("w", dir=dir_name, delete=False, encoding="utf-8") as tmp_file:
-            json.dump(data, tmp_file, indent=4, ensure_ascii=False)
-            tmp_file.flush()
-            os.fsync(tmp_file.fileno()) # Garante que foi escrito no disco
-            tmp_path = tmp_file.name
-
-        # Substituição atômica
-        try:
-            os.replace(tmp_path, filepath)
-        except OSError as e:
-            print(f"❌ Erro ao salvar arquivo {filepath}: {e}")
-            if os.path.exists(tmp_path):
-                os.remove(tmp_path)
+        key = (guild_id, filename)
+        entry = _FILE_CACHE.get(key)
+        now = time.monotonic()
+        # Alterações ainda não gravadas são mais novas que o disco: não recarrega
+        if entry and (entry.get("dirty") or now - entry["checked"] < CACHE_MTIME_CHECK_INTERVAL):
+            return entry["data"]
+
+        name = _doc_name(filename)
+        backend = get_backend(name)
+        mtime = backend.version(guild_id, name)
+        if entry and entry["mtime"] == mtime:
+            entry["checked"] = now
+            return entry["data"]
+
+        data = backend.get(guild_id, name, copy.deepcopy(default_data))
+        register_guild(guild_id)  # A leitura cria o arquivo padrão: o servidor passa a ter dados
+        _FILE_CACHE[key] = {"data": data, "mtime": backend.version(guild_id, name), "checked": now}
+        return data
+
+    @staticmethod
+    def save_cached(guild_id: str, filename: str, data: dict) -> None:
+        """Salva atomicamente e atualiza o cache (write-through)"""
+        guild_id = str(guild_id)
+        name = _doc_name(filename)
+        backend = get_backend(name)
+        policy = WRITE_POLICIES.get(filename, DEFAULT_WRITE_POLICY)
+        backend.put(guild_id, name, data, durable=policy["fsync"])
+        if filename in CACHED_FILES:
+            _FILE_CACHE[(guild_id, filename)] = {
+                "data": copy.deepcopy(data),
+                "mtime": backend.version(guild_id, name),
+                "checked": time.monotonic()
+            }
+
+    @staticmethod
+    def invalidate_cache(guild_id: str = None) -> None:
+        """Descarta o cache de um servidor (ou de todos)"""
+        for key in list(_FILE_CACHE):
+            if guild_id is None or key[0] == str(guild_id):
+                _FILE_CACHE.pop(key, None)
+
+    @staticmethod
+    def save_sync(filepath: str, data: dict, fsync: bool = True) -> None:
+        """Escreve JSON de forma ATÔMICA (Safe Write) num caminho qualquer"""
+        storage.atomic_write_json(filepath, data, fsync=fsync)
 
     @staticmethod
     async def save_guild_data(guild_id: str, filename: str, data: dict) -> None:
         """
         Salva dados de forma assíncrona.
         """
-        lock = get_guild_lock(str(guild_id))
-        path = DataManager.get_path(guild_id, filename)
+        lock = get_guild_lock(str(guild_id), filename)
         
-        async with lock:
-            loop = asyncio.get_running_loop()
-            await loop.run_in_executor(None, DataManager.save_sync, path, data)
+        async with lock.write():
+            await DataManager.run_io(DataManager.save_cached, guild_id, filename, data)
+
+    @staticmethod
+    async def update_buffered(guild_id: str, filename: str, loader, modification_callback):
+        """
+        Aplica a modificação no cache imediatamente e agenda UMA gravação por janela de debounce.
+        Rajadas de cliques no painel viram uma única escrita atômica no disco.
+        """
+        guild_id = str(guild_id)
+        key = (guild_id, filename)
+        policy = WRITE_POLICIES.get(filename, DEFAULT_WRITE_POLICY)
+
+        register_guild(guild_id)
+        current = loader(guild_id)  # Cópia do cache
+        new_data = modification_callback(current)
+        _FILE_CACHE[key] = {
+            "data": copy.deepcopy(new_data),
+            "mtime": _FILE_CACHE.get(key, {}).get("mtime"),
+            "checked": time.monotonic(),
+            "dirty": True
+        }
+
+        if policy["debounce"] <= 0:
+            await DataManager.flush(guild_id, filename)
+        elif key not in _PENDING_FLUSHES:
+            _PENDING_FLUSHES[key] = asyncio.create_task(DataManager._delayed_flush(key, policy["debounce"]))
+        return new_data
+
+    @staticmethod
+    async def _delayed_flush(key: tuple, delay: float) -> None:
+        await asyncio.sleep(delay)
+        _PENDING_FLUSHES.pop(key, None)
+        await DataManager.flush(*key)
+
+    @staticmethod
+    async def flush(guild_id: str, filename: str) -> None:
+        """Grava no disco as alterações pendentes de um arquivo (se houver)"""
+        key = (str(guild_id), filename)
+        lock = get_guild_lock(key[0], filename)
+        async with lock.write():
+            entry = _FILE_CACHE.get(key)
+            if not entry or not entry.get("dirty"): return
+            snapshot = copy.deepcopy(entry["data"])
+            entry["dirty"] = False
+            try:
+                await DataManager.run_io(DataManager._write_snapshot, key, snapshot)
+            except Exception as e:
+                entry["dirty"] = True  # Tenta de novo no próximo flush
+                print(f"❌ Erro ao gravar {filename} de {guild_id}: {e}")
+
+    @staticmethod
+    def _write_snapshot(key: tuple, snapshot: dict) -> None:
+        guild_id, filename = key
+        name = _doc_name(filename)
+        backend = get_backend(name)
+        policy = WRITE_POLICIES.get(filename, DEFAULT_WRITE_POLICY)
+        backend.put(guild_id, name, snapshot, durable=policy["fsync"])
+        entry = _FILE_CACHE.get(key)
+        if entry is not None:
+            entry["mtime"] = backend.version(guild_id, name)
+
+    @staticmethod
+    async def flush_all() -> None:
+        """Grava todas as alterações pendentes (chamar antes de desligar)"""
+        for task in list(_PENDING_FLUSHES.values()):
+            task.cancel()
+        _PENDING_FLUSHES.clear()
+        for key, entry in list(_FILE_CACHE.items()):
+            if entry.get("dirty"):
+                await DataManager.flush(*key)
+
+    @staticmethod
+    def flush_all_sync() -> None:
+        """Versão síncrona de flush_all (para quando o loop de eventos já foi encerrado)"""
+        _PENDING_FLUSHES.clear()
+        for key, entry in list(_FILE_CACHE.items()):
+            if entry.get("dirty"):
+                entry["dirty"] = False
+                DataManager._write_snapshot(key, copy.deepcopy(entry["data"]))
 
 # --- FUNÇÕES DE ACESSO A DADOS (GETTERS) ---
 
@@ -131,35 +514,28 @@ def get_setup_id(guild_id: int, key: str) -> int:
     val = cfg.get("setup", {}).get(key)
     return int(val) if val else None
 
+def get_extraction_settings(guild_id: str) -> dict:
+    """Configurações de extração do servidor (seção "extracao" do config.json) com os padrões aplicados"""
+    settings = dict(EXTRACTION_DEFAULTS)
+    settings.update(get_config(guild_id).get("extracao", {}) if guild_id else {})
+    try:
+        settings["concorrencia"] = max(1, min(int(settings["concorrencia"]), EXTRACTION_MAX_CONCURRENCY))
+    except (TypeError, ValueError):
+        settings["concorrencia"] = EXTRACTION_DEFAULTS["concorrencia"]
+    if settings["modo"] not in EXTRACTION_MODES:
+        settings["modo"] = "canais"
+    settings["formato"], settings["nivel"] = archive.normalizar_formato(settings["formato"], settings["nivel"])
+    return settings
+
 # --- FUNÇÕES DE ATUALIZAÇÃO SEGURA (CORRIGIDAS) ---
 
 async def update_config(guild_id: str, modification_callback):
-    """Atualiza a configuração de um servidor atomicamente"""
-    lock = get_guild_lock(str(guild_id))
-    
-    def _sync_update():
-        current = get_config(guild_id) # Lê
-        new_data = modification_callback(current) # Modifica
-        DataManager.save_sync(DataManager.get_path(guild_id, "config.json"), new_data) # Salva
-        return new_data
-
-    async with lock:
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, _sync_update)
+    """Atualiza a configuração de um servidor (em memória na hora, no disco após o debounce)"""
+    return await DataManager.update_buffered(guild_id, "config.json", get_config, modification_callback)
 
 async def update_categories(guild_id: str, modification_callback):
-    """Atualiza categorias de um servidor atomicamente"""
-    lock = get_guild_lock(str(guild_id))
-    
-    def _sync_update():
-        current = get_categories(guild_id)
-        new_data = modification_callback(current)
-        DataManager.save_sync(DataManager.get_path(guild_id, "categorias.json"), new_data)
-        return new_data
-
-    async with lock:
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, _sync_update)
+    """Atualiza categorias de um servidor (em memória na hora, no disco após o debounce)"""
+    return await DataManager.update_buffered(guild_id, "categorias.json", get_categories, modification_callback)
 
 # --- GERENCIAMENTO DE PENDÊNCIAS (NOVO) ---
 
@@ -167,69 +543,36 @@ async def log_pending_safe(guild_id: str, thread_id: int, thread_name: str,
                            resolvido_por: str, resolvido_por_id: int, 
                            categoria: str, orgao: str, canal_origem: str) -> None:
     """Adiciona um tópico à lista de pendências de aprovação"""
-    lock = get_guild_lock(str(guild_id))
-    
-    def _sync_log():
-        path = DataManager.get_path(guild_id, "pendencias.json")
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                db = json.load(f)
-        except:
-            db = []
-        
-        # Cria entrada
-        new_data = {
-            "data_solicitacao": datetime.now(BRT_OFFSET).isoformat(),
-            "thread_id": str(thread_id),
-            "thread_nome": thread_name,
-            "canal_origem": canal_origem,
-            "resolvido_por": resolvido_por,
-            "resolvido_por_id": str(resolvido_por_id),
-            "orgao": orgao,
-            "categoria": categoria
-        }
-        
-        # Remove se já existir (atualização)
-        db = [entry for entry in db if entry.get("thread_id") != str(thread_id)]
-        db.append(new_data)
-        
-        DataManager.save_sync(path, db)
-
-    async with lock:
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, _sync_log)
+    # Cria entrada (se já existir, é substituída e vai para o fim da fila)
+    new_data = {
+        "data_solicitacao": datetime.now(BRT_OFFSET).isoformat(),
+        "thread_id": str(thread_id),
+        "thread_nome": thread_name,
+        "canal_origem": canal_origem,
+        "resolvido_por": resolvido_por,
+        "resolvido_por_id": str(resolvido_por_id),
+        "orgao": orgao,
+        "categoria": categoria
+    }
+    register_guild(guild_id)
+    async with get_guild_lock(guild_id, "pendencias").write():
+        await DataManager.run_io(get_backend("pendencias").upsert, str(guild_id), "pendencias", new_data, move_to_end=True)
 
 async def get_pending_data(guild_id: str, thread_id: int) -> dict:
     """Recupera dados de uma pendência específica"""
-    path = DataManager.get_path(guild_id, "pendencias.json")
-    if not os.path.exists(path): return None
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            db = json.load(f)
-        return next((item for item in db if item["thread_id"] == str(thread_id)), None)
-    except:
+        async with get_guild_lock(guild_id, "pendencias").read():
+            return await DataManager.run_io(get_backend("pendencias").get_item, str(guild_id), "pendencias", str(thread_id))
+    except Exception:
         return None
 
 async def remove_pending_safe(guild_id: str, thread_id: int) -> None:
     """Remove um tópico da lista de pendências"""
-    lock = get_guild_lock(str(guild_id))
-    
-    def _sync_remove():
-        path = DataManager.get_path(guild_id, "pendencias.json")
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                db = json.load(f)
-            
-            novo_db = [entry for entry in db if entry.get("thread_id") != str(thread_id)]
-            
-            if len(novo_db) < len(db):
-                DataManager.save_sync(path, novo_db)
-        except:
-            pass
-
-    async with lock:
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, _sync_remove)
+    try:
+        async with get_guild_lock(guild_id, "pendencias").write():
+            await DataManager.run_io(get_backend("pendencias").remove, str(guild_id), "pendencias", str(thread_id))
+    except Exception as e:
+        print(f"⚠️ Erro ao remover pendência {thread_id}: {e}")
 
 # --- GERENCIAMENTO DE RESOLUÇÕES (FINALIZADAS) ---
 
@@ -237,91 +580,180 @@ async def log_resolution_safe(guild_id: str, thread_id: int, thread_name: str,
                             resolvido_por: str, resolvido_por_id: int, 
                             categoria: str, orgao: str) -> None:
     """Salva a resolução definitiva atomicamente (após aprovação)"""
-    lock = get_guild_lock(str(guild_id))
-    
-    def _sync_log():
-        path = DataManager.get_path(guild_id, "resolucoes.json")
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                db = json.load(f)
-        except:
-            db = []
-        
-        # Atualiza ou cria entrada
-        entry = next((i for i in db if i.get("thread_id") == str(thread_id)), None)
-        new_data = {
-            "data": datetime.now(BRT_OFFSET).isoformat(),
-            "thread_id": str(thread_id),
-            "thread_nome": thread_name,
-            "resolvido_por": resolvido_por,
-            "resolvido_por_id": str(resolvido_por_id),
-            "orgao": orgao,
-            "categoria": categoria
-        }
-        
-        if entry:
-            entry.update(new_data)
-        else:
-            db.append(new_data)
-            
-        DataManager.save_sync(path, db)
-
-    async with lock:
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, _sync_log)
+    # Atualiza ou cria entrada
+    new_data = {
+        "data": datetime.now(BRT_OFFSET).isoformat(),
+        "thread_id": str(thread_id),
+        "thread_nome": thread_name,
+        "resolvido_por": resolvido_por,
+        "resolvido_por_id": str(resolvido_por_id),
+        "orgao": orgao,
+        "categoria": categoria,
+        "extraido_em": None,  # (Re)aprovado: ainda não entrou em nenhuma extração
+        "ignorado_em": None
+    }
+    register_guild(guild_id)
+    async with get_guild_lock(guild_id, "resolucoes").write():
+        await DataManager.run_io(get_backend("resolucoes").upsert, str(guild_id), "resolucoes", new_data)
+
+async def get_resolution(guild_id: str, thread_id: int) -> dict:
+    """Recupera a resolução de um tópico (None se não foi aprovado para extração)"""
+    return await DataManager.run_io(get_backend("resolucoes").get_item, str(guild_id), "resolucoes", str(thread_id))
+
+def load_resolution_index(guild_id: str) -> dict:
+    """Índice thread_id -> resolução do servidor inteiro (uma única leitura)"""
+    return {r["thread_id"]: r for r in get_backend("resolucoes").get(str(guild_id), "resolucoes", [])}
+
+def get_unextracted_resolutions(guild_id: str, resolucoes: dict = None, desde: datetime = None) -> list:
+    """
+    Resoluções aprovadas que ainda não entraram em nenhuma extração (ordem de aprovação).
+    Ficam de fora as ignoradas (tópico apagado, inacessível ou fora dos canais conectados).
+    `desde`: só as aprovadas a partir desse momento.
+    """
+    if resolucoes is None: resolucoes = load_resolution_index(guild_id)
+    return [r for r in resolucoes.values() if not r.get("extraido_em") and not r.get("ignorado_em")
+            and (desde is None or datetime.fromisoformat(r["data"]) >= desde)]
+
+async def _mark_resolutions(guild_id: str, resolucoes: list, campo: str, quando: datetime) -> None:
+    """
+    Grava `campo` nas resoluções. Uma resolução reaprovada durante a extração
+    (campo "data" diferente do lido no início) continua pendente para a próxima.
+    """
+    backend = get_backend("resolucoes")
+    def _marcar():
+        for r in resolucoes:
+            atual = backend.get_item(str(guild_id), "resolucoes", r["thread_id"])
+            if not atual or atual.get("data") != r.get("data"): continue
+            atual[campo] = quando.isoformat()
+            backend.upsert(str(guild_id), "resolucoes", atual)
+    async with get_guild_lock(guild_id, "resolucoes").write():
+        await DataManager.run_io(_marcar)
+
+async def mark_resolutions_extracted(guild_id: str, resolucoes: list, quando: datetime) -> None:
+    """Grava `extraido_em` nas resoluções extraídas"""
+    await _mark_resolutions(guild_id, resolucoes, "extraido_em", quando)
+
+async def mark_resolutions_ignored(guild_id: str, resolucoes: list, quando: datetime) -> None:
+    """Grava `ignorado_em`: tópico que não tem como ser extraído (não é buscado de novo até ser reaprovado)"""
+    await _mark_resolutions(guild_id, resolucoes, "ignorado_em", quando)
 
 async def remove_resolution(guild_id: str, thread_id: int) -> bool:
     """Remove entrada de resolução do banco atomicamente"""
-    lock = get_guild_lock(str(guild_id))
-    
-    def _sync_remove():
-        path = DataManager.get_path(guild_id, "resolucoes.json")
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                db = json.load(f)
-            
-            novo_db = [entry for entry in db if entry.get("thread_id") != str(thread_id)]
-            
-            if len(novo_db) < len(db):
-                DataManager.save_sync(path, novo_db)
-                return True
-        except:
-            pass
+    try:
+        async with get_guild_lock(guild_id, "resolucoes").write():
+            return await DataManager.run_io(get_backend("resolucoes").remove, str(guild_id), "resolucoes", str(thread_id))
+    except Exception as e:
+        print(f"⚠️ Erro ao remover resolução {thread_id}: {e}")
         return False
 
-    async with lock:
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, _sync_remove)
-
 async def registrar_log_safe(guild_id: str, acao: str, usuario: str, detalhes: str) -> None:
-    """Registra log no arquivo do servidor atomicamente"""
+    """Registra log no arquivo do servidor (append-only, escrito pela thread do log de auditoria)"""
     if not guild_id: return
-    lock = get_guild_lock(str(guild_id))
-    
-    def _sync_log():
-        path = DataManager.get_path(guild_id, "logs.json")
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                logs = json.load(f)
-        except:
-            logs = []
-            
-        logs.append({
-            "timestamp": datetime.now(BRT_OFFSET).isoformat(),
-            "acao": acao,
-            "usuario": usuario,
-            "detalhes": detalhes
+    audit_log.append(get_log_folder(guild_id), {
+        "timestamp": datetime.now(BRT_OFFSET).isoformat(),
+        "acao": acao,
+        "usuario": usuario,
+        "detalhes": detalhes
+    })
+
+def get_log_folder(guild_id: str) -> str:
+    return os.path.join(BASE_DATA_PATH, str(guild_id), audit_log.LOG_DIRNAME)
+
+def get_recent_logs(guild_id: str, limit: int = 50):
+    """Itera (preguiçosamente) os logs mais recentes do servidor, do mais novo ao mais antigo"""
+    return audit_log.iter_recent(get_log_folder(guild_id), limit)
+
+def get_attachments_folder(guild_id: str) -> str:
+    """Anexos espelhados do servidor (blobs endereçados pelo hash do conteúdo)"""
+    return os.path.join(BASE_DATA_PATH, str(guild_id), attachments.ATTACHMENTS_DIRNAME)
+
+def get_blob_store(guild_id: str) -> attachments.BlobStore:
+    return attachments.BlobStore(get_attachments_folder(guild_id), get_backend("anexos"), guild_id)
+
+# --- CURSORES DE HISTÓRICO (EXTRAÇÃO INCREMENTAL) ---
+# Por tópico: último ID de mensagem extraído (backend "cursores") e as mensagens já buscadas,
+# cruas (toon.registro), em ./dados_servidores/{guild_id}/historico/{thread_id}.jsonl
+HISTORY_DIRNAME = "historico"
+
+def get_history_cache_path(guild_id: str, thread_id: int) -> str:
+    return os.path.join(BASE_DATA_PATH, str(guild_id), HISTORY_DIRNAME, f"{thread_id}.jsonl")
+
+def get_history_cursor(guild_id: str, thread_id: int) -> dict:
+    """Cursor do tópico (None se nunca foi extraído)"""
+    entry = get_backend("cursores").get_item(str(guild_id), "cursores", str(thread_id))
+    if not entry: return None
+    return {"last_id": int(entry["last_id"]), "mensagens": int(entry["mensagens"]), "tamanho": int(entry["tamanho"])}
+
+def save_history_cursor(guild_id: str, thread_id: int, last_id: int, mensagens: int, tamanho: int) -> None:
+    get_backend("cursores").upsert(str(guild_id), "cursores", {
+        "thread_id": str(thread_id),
+        "last_id": str(last_id),
+        "mensagens": mensagens,
+        "tamanho": tamanho,
+        "atualizado": datetime.now(BRT_OFFSET).isoformat()
+    })
+
+# --- VERSÕES EXTRAÍDAS (POR TÓPICO) ---
+# Cada tópico que vai para um pacote registra a versão extraída: "thread_id:last_message_id",
+# com o last_message_id do próprio objeto do tópico (o que a listagem compara). Não é o último ID
+# renderizado: a última mensagem costuma ser o "✅ Aprovado!", apagado antes do arquivamento.
+# Um tópico arquivado só precisa ser extraído de novo se a versão atual não estiver registrada.
+
+def version_key(thread_id, last_id) -> str:
+    return f"{thread_id}:{last_id}"
+
+def load_extracted_versions(guild_id: str) -> set:
+    """Versões já extraídas do servidor (uma única leitura)"""
+    return {v["versao"] for v in get_backend("versoes").get(str(guild_id), "versoes", [])}
+
+def save_extracted_versions(guild_id: str, versoes: list, quando: datetime) -> None:
+    """Registra [(thread_id, last_message_id, pacote)] extraídos num pacote concluído"""
+    backend = get_backend("versoes")
+    for thread_id, last_id, pacote in versoes:
+        backend.upsert(str(guild_id), "versoes", {
+            "versao": version_key(thread_id, last_id), "thread_id": str(thread_id),
+            "last_id": str(last_id), "extraido_em": quando.isoformat(), "pacote": pacote
         })
-        
-        # Rotação de logs
-        if len(logs) > 1000:
-            logs = logs[-1000:]
-            
-        DataManager.save_sync(path, logs)
 
-    async with lock:
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, _sync_log)
+# --- JOURNAL DAS EXTRAÇÕES (RETOMADA APÓS QUEDA) ---
+# Cada extração é um job (chave = escopo: canais alvo + force_all). Cada tópico concluído
+# vira um checkpoint com o último ID já renderizado no histórico local (ver cursores acima) e o
+# last_message_id que o tópico tinha: se o bot cair no meio, a próxima execução do mesmo escopo
+# remonta do histórico local, sem chamar a API, os tópicos cujo last_message_id não mudou.
+# (Não dá para comparar com o último ID renderizado: a última mensagem do tópico costuma ser
+# o "✅ Aprovado!" já apagado.) O job só é apagado quando uma execução termina.
+EXTRACTION_JOB_MAX_AGE = timedelta(days=float(os.getenv("EXTRACTION_JOB_MAX_AGE_DAYS", "7")))
+
+def open_extraction_job(guild_id: str, job: str) -> dict:
+    """Abre ou retoma o job; retorna thread_id -> {"last_id", "versao"} dos tópicos já concluídos"""
+    backend = get_backend("extracoes")
+    agora = datetime.now(BRT_OFFSET)
+    entry = backend.get_item(str(guild_id), "extracoes", job)
+    if entry and agora - datetime.fromisoformat(entry["iniciado_em"]) > EXTRACTION_JOB_MAX_AGE:
+        close_extraction_job(guild_id, job)  # Antigo demais: recomeça do zero
+        entry = None
+    if not entry:
+        backend.upsert(str(guild_id), "extracoes", {"job": job, "iniciado_em": agora.isoformat()})
+        return {}
+    return {c["thread_id"]: {"last_id": int(c["last_id"]), "versao": int(c["versao"]) if c.get("versao") else None}
+            for c in get_backend("checkpoints").get(str(guild_id), "checkpoints", []) if c.get("job") == job}
+
+def save_extraction_checkpoint(guild_id: str, job: str, thread_id: int, last_id: int, versao: int = None) -> None:
+    """`versao`: last_message_id do tópico na extração"""
+    get_backend("checkpoints").upsert(str(guild_id), "checkpoints", {
+        "checkpoint": f"{job}:{thread_id}", "job": job, "thread_id": str(thread_id),
+        "last_id": str(last_id), "versao": str(versao) if versao is not None else None,
+        "concluido_em": datetime.now(BRT_OFFSET).isoformat()
+    })
+
+def close_extraction_job(guild_id: str, job: str) -> None:
+    """Apaga o job e os checkpoints dele (execução concluída)"""
+    get_backend("checkpoints").update(str(guild_id), "checkpoints",
+                                      lambda items: [c for c in (items or []) if c.get("job") != job], [])
+    get_backend("extracoes").remove(str(guild_id), "extracoes", job)
+
+def list_extraction_jobs(guild_id: str) -> list:
+    return get_backend("extracoes").get(str(guild_id), "extracoes", [])
 
 # --- UTILITÁRIOS GERAIS ---
 def sanitize_input(texto: str, max_len: int = 50) -> str:
@@ -340,7 +772,33 @@ async def execute_with_retry(bot, funcao, *args, tentativas=3, delay=2, **kwargs
             if i == tentativas - 1: raise e
             await asyncio.sleep(delay)
 
+# --- REGISTRO DE SERVIDORES (substitui varreduras de diretório) ---
+_GUILD_REGISTRY = None  # set de guild_id (str) com dados; None = ainda não carregado
+
+def init_guild_registry() -> set:
+    """Varre BASE_DATA_PATH UMA vez (startup) e monta o registro em memória"""
+    global _GUILD_REGISTRY
+    found = set()
+    if os.path.exists(BASE_DATA_PATH):
+        for d in os.listdir(BASE_DATA_PATH):
+            folder = os.path.join(BASE_DATA_PATH, d)
+            if d.isdigit() and os.path.isdir(folder):
+                found.add(d)
+                storage.mark_folder_known(folder)
+    _GUILD_REGISTRY = found
+    return found
+
+def register_guild(guild_id) -> None:
+    """Marca o servidor como ativo (entrada no servidor ou primeira escrita)"""
+    if _GUILD_REGISTRY is None: init_guild_registry()
+    _GUILD_REGISTRY.add(str(guild_id))
+
+def unregister_guild(guild_id) -> None:
+    """Remove o servidor do registro (saída do servidor). Os dados em disco são mantidos."""
+    if _GUILD_REGISTRY is None: init_guild_registry()
+    _GUILD_REGISTRY.discard(str(guild_id))
+
 def get_all_active_guilds():
-    """Retorna lista de IDs de servidores que possuem pasta de dados"""
-    if not os.path.exists(BASE_DATA_PATH): return []
-    return [d for d in os.listdir(BASE_DATA_PATH) if os.path.isdir(os.path.join(BASE_DATA_PATH, d)) and d.isdigit()]
\ No newline at end of file
+    """Retorna lista de IDs de servidores que possuem dados (sem tocar o disco)"""
+    if _GUILD_REGISTRY is None: init_guild_registry()
+    return sorted(_GUILD_REGISTRY)
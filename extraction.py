@@ -7,18 +7,35 @@ from discord.ext import commands, tasks
 from discord import app_commands
 import aiohttp
 import os
+import uuid
 import shutil
+import heapq
 import asyncio
+import itertools
+import contextlib
 import traceback
+import collections
+import time as time_mod
 from datetime import datetime, time, timedelta
 
+import toon
+import fetch
+import archive
+import attachments
+
 # Importa da nova configuração isolada
 from config import (
-    DataManager, get_config, get_categories, get_setup_id,
-    clean_name, registrar_log_safe, log_resolution_safe, remove_resolution,
+    DataManager, get_config, get_categories, get_setup_id, get_extraction_settings,
+    clean_name, registrar_log_safe, log_resolution_safe, remove_resolution, get_resolution,
+    load_resolution_index, get_unextracted_resolutions, mark_resolutions_extracted, mark_resolutions_ignored,
+    version_key, load_extracted_versions, save_extracted_versions,
+    get_history_cursor, save_history_cursor, get_history_cache_path, get_guild_lock, get_blob_store,
+    open_extraction_job, save_extraction_checkpoint, close_extraction_job, get_all_active_guilds,
+    get_attachments_folder,
     log_pending_safe, remove_pending_safe, get_pending_data, 
-    update_config, get_all_active_guilds,
-    BRT_OFFSET, HORA_BACKUP, MINUTO_BACKUP, execute_with_retry as executar_com_retry
+    update_config, register_guild, unregister_guild,
+    BRT_OFFSET, HORA_BACKUP, MINUTO_BACKUP, EXTRACTION_GLOBAL_CONCURRENCY, DAILY_GUILD_TIMEOUT, EXTRACTION_PACK_PROCESS,
+    execute_with_retry as executar_com_retry
 )
 
 # Importa as Views atualizadas
@@ -28,6 +45,7 @@ from ui_components import (
 )
 
 _bot_instance = None
+DAILY_RUN_METRICS = {}  # Última execução do backup diário: duração total e por servidor
 
 def set_bot(bot):
     """Define referência global do bot para uso em callbacks"""
@@ -275,6 +293,14 @@ async def rejeitar_aprovacao(bot, interaction: discord.Interaction, guild_id: st
 # --- EVENTOS DO BOT ---
 def setup_events(bot):
     
+    @bot.event
+    async def on_guild_join(guild: discord.Guild):
+        register_guild(guild.id)
+
+    @bot.event
+    async def on_guild_remove(guild: discord.Guild):
+        unregister_guild(guild.id)
+    
     @bot.event
     async def on_message(message: discord.Message):
         if message.author.id == bot.user.id: return
@@ -291,70 +317,316 @@ def setup_events(bot):
 
 # --- LÓGICA DE EXTRAÇÃO (BACKEND) ---
 
+HISTORY_LOCK_PREFIX = "historico/"
+ANEXOS_JANELA = 32  # Mensagens com anexos em download simultâneo dentro de um tópico
+HISTORICO_LOTE = 200  # Mensagens acumuladas antes de cada escrita no histórico local
+TEMP_BACKUPS_DIR = "./temp_backups"
+
 class ExtractionEngine:
     @staticmethod
-    def gerar_texto_toon(contexto: dict, mensagens: list) -> str:
-        lines = ["contexto:"] + [f"  {k}: {v}" for k, v in contexto.items()]
-        if mensagens:
-            # Modificado: Retirada a tag 'data' do cabeçalho
-            lines.append(f"mensagens[{len(mensagens)}]{{autor,mensagem}}:")
-            for m in mensagens:
-                txt = m['conteudo'].replace('\n', ' ')
-                anexos_formatados = []
-                for a in m['anexos']:
-                    is_img = any(ext in a.lower() for ext in ['.png', '.jpg', '.jpeg', '.gif', '.webp', '.bmp'])
-                    tag = "IMAGEM" if is_img else "ARQUIVO"
-                    anexos_formatados.append(f"[{tag}: {a}]")
-                anexos_str = " ".join(anexos_formatados)
-                full = f"{txt} {anexos_str}".strip()
-                # Modificado: Retirado m['timestamp_brt'] da string final
-                lines.append(f"  {m['autor']['nome']}, {full}")
-        return "\n".join(lines)
+    def nome_topico(thread) -> str:
+        return f"topico_{clean_name(thread.name)}.txt"
 
     @staticmethod
-    async def extrair_topico(bot, session, thread, pasta_destino, guild_id):
-        nome = clean_name(thread.name)
-        msgs = []
-        
-        # Recupera metadados da RESOLUÇÃO
-        # Se não estiver em resolucoes.json, retorna False (não extrai)
+    async def coletar_topico(bot, thread, guild_id, resolucoes: dict = None, mirror=None, reusar_ate: int = None):
+        """
+        Atualiza o histórico local do tópico e retorna (toon.ToonHistorico, último ID lido), ou None
+        se não houver o que extrair. O registro só aponta para o histórico: o TOON é renderizado e
+        montado por quem o escreve (o processo de empacotamento, ver archive.py e toon.py).
+        `reusar_ate`: last_id do checkpoint de um job interrompido, para tópico sem mensagens novas
+        desde então (ver ExtractionJournal.reusar_ate); se o histórico local ainda está nesse ponto,
+        o TOON sai só do histórico local.
+        """
+        # Recupera metadados da RESOLUÇÃO (do índice da execução, se fornecido)
+        # Se não estiver no banco de resoluções, retorna None (não extrai)
         try:
-            db_path = DataManager.get_path(str(guild_id), "resolucoes.json")
-            import json
-            if os.path.exists(db_path):
-                with open(db_path, 'r', encoding='utf-8') as f: db = json.load(f)
-                entry = next((r for r in db if r["thread_id"] == str(thread.id)), None)
-            else: entry = None
+            if resolucoes is not None:
+                entry = resolucoes.get(str(thread.id))
+            else:
+                entry = await get_resolution(str(guild_id), thread.id)
             
             # SE NÃO TIVER ENTRY, SIGNIFICA QUE NÃO FOI APROVADO PARA EXTRAÇÃO
             if not entry:
-                return False
+                return None
 
             cat = entry["categoria"]
-            orgao_val = entry.get("orgao", "N/A")
-        except: 
-            return False # Erro na leitura ou sem permissão
+            orgao_val = entry.get("orgao") or "N/A"
+        except Exception:
+            return None # Erro na leitura ou sem permissão
 
-        async for m in thread.history(limit=None, oldest_first=True):
-            if m.author.id == bot.user.id: continue
-            paths_or_links = [a.url for a in m.attachments] if m.attachments else []
-            
-            # Modificado: Usando clean_content para substituir menções por nomes (@Pessoa)
-            conteudo_limpo = m.clean_content
-
-            msgs.append({
-                "timestamp_brt": m.created_at.astimezone(BRT_OFFSET).strftime("%Y-%m-%d %H:%M:%S"),
-                "autor": {"nome": m.author.display_name}, # Modificado: Usando display_name para ser mais amigável
-                "conteudo": conteudo_limpo,
-                "anexos": paths_or_links
-            })
-
-        if msgs:
-            ctx = {"origem": thread.parent.name if thread.parent else "N/A", "nome": thread.name, "orgao": orgao_val, "categoria": cat, "id": str(thread.id)}
-            with open(os.path.join(pasta_destino, f"topico_{nome}.txt"), "w", encoding="utf-8") as f:
-                f.write(ExtractionEngine.gerar_texto_toon(ctx, msgs))
-            return True
-        return False
+        ctx = {"origem": thread.parent.name if thread.parent else "N/A", "nome": thread.name, "orgao": orgao_val, "categoria": cat, "id": str(thread.id)}
+        # O histórico local do tópico é exclusivo de uma extração por vez
+        async with get_guild_lock(guild_id, f"{HISTORY_LOCK_PREFIX}{thread.id}").write():
+            cursor = await DataManager.run_io(get_history_cursor, guild_id, thread.id)
+            buscar = not (reusar_ate is not None and cursor and cursor["last_id"] == reusar_ate)
+            last_id, mensagens, tamanho = await ExtractionEngine._escrever_historico(bot, thread, guild_id, cursor, mirror, buscar)
+
+        if not mensagens: return None
+        return toon.ToonHistorico(ctx, get_history_cache_path(guild_id, thread.id), tamanho, mensagens), last_id
+
+    @staticmethod
+    async def _escrever_historico(bot, thread, guild_id, cursor, mirror=None, buscar=True) -> tuple:
+        """
+        Busca na API apenas as mensagens posteriores ao cursor (history(after=last_id)) e acrescenta
+        os registros crus (toon.registro) ao histórico local, em lotes de HISTORICO_LOTE mensagens
+        (uma escrita no executor de I/O por lote); o cursor é avançado no final, depois da última
+        escrita. A renderização do TOON fica para o processo de empacotamento.
+        Retorna (último ID lido, total de mensagens, tamanho do histórico em bytes).
+        Com `mirror`, os anexos novos são baixados e a linha aponta para a cópia local.
+        Com buscar=False (e histórico local válido), não chama a API.
+        """
+        cache_path = get_history_cache_path(guild_id, thread.id)
+        tamanho = await DataManager.run_io(_preparar_historico, cache_path, cursor)
+        if tamanho is not None:
+            after, last_id, mensagens = discord.Object(id=cursor["last_id"]), cursor["last_id"], cursor["mensagens"]
+            if not buscar: return last_id, mensagens, tamanho
+        else:
+            # Sem cursor (ou histórico local perdido): extração completa
+            cursor, after, last_id, mensagens, tamanho = None, None, None, 0, 0
+
+        lote = []
+        def emitir(autor, conteudo, anexos):
+            nonlocal mensagens
+            lote.append((autor, conteudo, anexos))
+            mensagens += 1
+
+        async def gravar():
+            nonlocal tamanho
+            if not lote: return
+            registros = lote[:]
+            lote.clear()
+            tamanho = await DataManager.run_io(_anexar_historico, cache_path, registros)
+
+        # Com espelhamento, os downloads de até ANEXOS_JANELA mensagens correm em paralelo
+        # e as linhas saem na ordem original, cada uma assim que os anexos dela terminam
+        janela = collections.deque()
+        async def emitir_proxima():
+            autor, conteudo, urls, tarefas = janela.popleft()
+            locais = [await tarefa for tarefa in tarefas]
+            # Blobs ficam em {raiz}/anexos/, um nível acima do arquivo do tópico
+            emitir(autor, conteudo, [f"../{attachments.ATTACHMENTS_DIRNAME}/{b}" if b else url for url, b in zip(urls, locais)])
+
+        try:
+            async for m in fetch.historico(thread, after):
+                last_id = m.id
+                if m.author.id == bot.user.id: continue
+                paths_or_links = [a.url for a in m.attachments] if m.attachments else []
+                # Modificado: clean_content substitui menções por nomes (@Pessoa) e display_name é mais amigável
+                if mirror is None or (not paths_or_links and not janela):
+                    emitir(m.author.display_name, m.clean_content, paths_or_links)
+                else:
+                    tarefas = [asyncio.create_task(mirror.baixar(thread.id, a.id, a.filename, a.url, a.size)) for a in m.attachments]
+                    janela.append((m.author.display_name, m.clean_content, paths_or_links, tarefas))
+                    while len(janela) > ANEXOS_JANELA:
+                        await emitir_proxima()
+                if len(lote) >= HISTORICO_LOTE: await gravar()
+            while janela:
+                await emitir_proxima()
+        finally:
+            for _, _, _, tarefas in janela:
+                for tarefa in tarefas: tarefa.cancel()
+        await gravar()
+
+        if last_id is not None and (not cursor or last_id != cursor["last_id"]):
+            await DataManager.run_io(save_history_cursor, guild_id, thread.id, last_id, mensagens, tamanho)
+        return last_id, mensagens, tamanho
+
+def _preparar_historico(cache_path: str, cursor) -> int:
+    """
+    Executor de I/O: deixa o histórico local no ponto do cursor e retorna o tamanho dele,
+    ou zera o arquivo e retorna None se ele não alcança o cursor (ou não há cursor).
+    O cursor é a fonte da verdade: bytes além de `tamanho` são de uma execução interrompida.
+    """
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    # Histórico do formato anterior (linhas já renderizadas): o cursor dele não vale para este arquivo
+    legado = os.path.splitext(cache_path)[0] + ".txt"
+    if os.path.exists(legado): os.remove(legado)
+    with open(cache_path, "a+b") as cache:
+        if cursor and cache.seek(0, os.SEEK_END) >= cursor["tamanho"]:
+            cache.truncate(cursor["tamanho"])
+            return cursor["tamanho"]
+        cache.truncate(0)
+        return None
+
+def _anexar_historico(cache_path: str, registros: list) -> int:
+    """Executor de I/O: acrescenta um lote de mensagens ao histórico local; retorna o novo tamanho"""
+    with open(cache_path, "ab") as cache:
+        cache.write(b"".join(toon.registro(*r) for r in registros))
+        return cache.tell()
+
+# --- CONCORRÊNCIA DA EXTRAÇÃO ---
+# Um ritmo por servidor: limita quantos tópicos têm o histórico lido ao mesmo tempo.
+# Cada tópico é um bucket de rate limit próprio; os 429 são tratados pelo discord.py. Buckets
+# com pouca folga seguram o limite, esgotados e 429 o reduzem (fetch.RitmoAdaptativo), e ele
+# volta a subir até a "concorrencia" configurada.
+_EXTRACTION_PACERS = {}  # guild_id -> (limite, fetch.RitmoAdaptativo)
+
+def get_extraction_pacer(guild_id: str) -> fetch.RitmoAdaptativo:
+    limite = get_extraction_settings(guild_id)["concorrencia"]
+    atual = _EXTRACTION_PACERS.get(str(guild_id))
+    # Limite alterado: novas extrações usam o novo ritmo (as em andamento terminam no antigo)
+    if atual is None or atual[0] != limite:
+        atual = _EXTRACTION_PACERS[str(guild_id)] = (limite, fetch.RitmoAdaptativo(limite))
+    return atual[1]
+
+async def extrair_topicos_concorrente(bot, threads: list, pacote: archive.ArchiveWriter, pasta: str,
+                                      guild_id, resolucoes: dict, mirror=None, selecao=None, journal=None) -> list:
+    """
+    Extrai os tópicos em paralelo (sob o ritmo do servidor) e os entrega ao pacote
+    na ordem da lista, independente de qual leitura terminar primeiro.
+    Cada tópico vai para o pacote junto com os seus anexos ainda não enviados (mesmo volume).
+    Com `journal`, cada tópico entregue vira um checkpoint do job.
+    Retorna os tópicos efetivamente extraídos: [(tópico, último ID extraído, entrada no pacote)].
+    """
+    ritmo = get_extraction_pacer(guild_id)
+
+    async def coletar(t):
+        reusar_ate = journal.reusar_ate(t) if journal else None
+        async with ritmo:
+            return await ExtractionEngine.coletar_topico(bot, t, guild_id, resolucoes, mirror, reusar_ate)
+
+    tasks = [asyncio.create_task(coletar(t)) for t in threads]
+    extraidos = []
+    try:
+        for t, task in zip(threads, tasks):
+            coletado = await task
+            if coletado is None: continue
+            registro, last_id = coletado
+            grupo = [(f"{pasta}/{ExtractionEngine.nome_topico(t)}", registro)]
+            if selecao is not None:
+                baixados = mirror.blobs_por_topico.get(str(t.id), ()) if mirror else ()
+                grupo += [(f"{attachments.ATTACHMENTS_DIRNAME}/{b}", selecao.store.caminho(b))
+                          for b in selecao.novos_do_topico(t.id, baixados)]
+            nomes = await pacote.add_group(grupo, topico=t.id)
+            extraidos.append((t, last_id, nomes[0]))
+            if journal: await journal.concluir_topico(t, last_id)
+    finally:
+        # Em caso de erro, não deixa leituras órfãs rodando
+        for task in tasks:
+            if not task.done(): task.cancel()
+    return extraidos
+
+async def listar_candidatos(ch, last_ts, resolucoes: dict, versoes: set, force_all=False) -> tuple:
+    """
+    Percorre os tópicos arquivados do canal (a API os devolve do arquivamento mais recente
+    para o mais antigo) e para de paginar no primeiro arquivado antes do marcador:
+    o custo acompanha a atividade nova, não a idade do canal.
+    Pula os tópicos cuja versão atual (último ID) já foi extraída com a resolução atual.
+    Retorna (candidatos, arquivamento mais recente visto): este é o próximo marcador, e não
+    o início da execução, para que tópicos arquivados durante a execução não fiquem de fora.
+    """
+    candidatos = []
+    mais_recente = None
+    async for t in fetch.arquivados(ch):
+        if t.archive_timestamp and (mais_recente is None or t.archive_timestamp > mais_recente):
+            mais_recente = t.archive_timestamp
+        if last_ts and t.archive_timestamp and t.archive_timestamp < last_ts: break
+        # Extrai APENAS se estiver trancado (resolvido/aprovado) e arquivado
+        if not t.locked or not t.archive_timestamp: continue
+        # Só extrai tópicos com resolução aprovada
+        r = resolucoes.get(str(t.id))
+        if not r: continue
+        if not force_all and r.get("extraido_em") and version_key(t.id, t.last_message_id) in versoes: continue
+        candidatos.append(t)
+    return candidatos, mais_recente
+
+async def buscar_candidatos_por_resolucao(bot, guild_id: str, channels_obj: list, pendentes: list) -> tuple:
+    """
+    Busca direto pelo ID os tópicos das resoluções `pendentes`, sem listar os arquivados
+    dos canais (modo "resolucoes", e no modo "canais" as aprovadas depois do arquivamento).
+    Retorna (canal -> tópicos, na ordem de aprovação; resoluções sem como extrair: tópico
+    apagado, inacessível ou fora dos canais conectados, para não serem buscadas toda execução).
+    """
+    canais = {ch.id: ch for ch in channels_obj}
+    conectados = {int(cid) for cid in get_config(guild_id).get("connected_channels", {})}
+    ritmo = get_extraction_pacer(guild_id)
+
+    async def buscar(r):
+        tid = int(r["thread_id"])
+        t = bot.get_channel(tid)
+        if t is None:
+            async with ritmo:
+                try: t = await bot.fetch_channel(tid)
+                except (discord.NotFound, discord.Forbidden): return None  # Tópico apagado ou inacessível
+        return t
+
+    threads = await asyncio.gather(*(buscar(r) for r in pendentes))
+    grupos = {}
+    ignoradas = []
+    for r, t in zip(pendentes, threads):
+        if t is None or not isinstance(t, discord.Thread) or t.parent_id not in conectados:
+            ignoradas.append(r)
+            continue
+        if t.parent_id not in canais: continue
+        # Mesmo critério do modo "canais": trancado e arquivado
+        if not t.locked or not t.archived: continue
+        grupos.setdefault(canais[t.parent_id], []).append(t)
+    # Canais na mesma ordem do modo "canais"
+    return {ch: grupos[ch] for ch in channels_obj if ch in grupos}, ignoradas
+
+# --- JOURNAL DA EXTRAÇÃO (RETOMADA APÓS QUEDA) ---
+
+class ExtractionJournal:
+    """Checkpoints de um job de extração (um job por escopo: canais alvo + force_all)"""
+
+    def __init__(self, guild_id: str, job: str, concluidos: dict):
+        self.guild_id = guild_id
+        self.job = job
+        self.concluidos = concluidos  # thread_id -> {"last_id" já renderizado no histórico local, "versao"}
+        self.retomados = 0
+
+    @staticmethod
+    def chave(target_channels=None, force_all=False) -> str:
+        escopo = "-".join(sorted(str(ch.id) for ch in target_channels)) if target_channels else "todos"
+        return f"{escopo}:completo" if force_all else escopo
+
+    @classmethod
+    async def abrir(cls, guild_id: str, target_channels=None, force_all=False):
+        job = cls.chave(target_channels, force_all)
+        concluidos = await DataManager.run_io(open_extraction_job, guild_id, job)
+        if concluidos:
+            print(f"♻️ [{guild_id}] Retomando extração interrompida ({job}): {len(concluidos)} tópicos já concluídos.")
+        return cls(guild_id, job, concluidos)
+
+    def reusar_ate(self, thread) -> int:
+        """last_id do checkpoint, se o tópico não recebeu mensagens desde então (senão None)"""
+        ck = self.concluidos.get(str(thread.id))
+        if ck and ck["versao"] is not None and ck["versao"] == thread.last_message_id: return ck["last_id"]
+        return None
+
+    async def concluir_topico(self, thread, last_id: int) -> None:
+        """Checkpoint do tópico entregue ao pacote: o ponto do histórico local que ele usou"""
+        if last_id is None: return
+        if self.reusar_ate(thread) == last_id:
+            self.retomados += 1
+            return
+        await DataManager.run_io(save_extraction_checkpoint, self.guild_id, self.job, thread.id, last_id,
+                                 thread.last_message_id)
+
+    async def fechar(self) -> None:
+        await DataManager.run_io(close_extraction_job, self.guild_id, self.job)
+
+def limpar_orfaos_extracao() -> int:
+    """
+    Startup (nenhuma extração em andamento): remove pacotes parciais de execuções
+    interrompidas e downloads de anexos pela metade. Os jobs continuam no journal.
+    """
+    removidos = 0
+    pastas = [(TEMP_BACKUPS_DIR, lambda nome: True)]
+    pastas += [(os.path.join(get_attachments_folder(g), attachments.BLOBS_DIRNAME), lambda nome: nome.endswith(".part"))
+               for g in get_all_active_guilds()]
+    for pasta, orfao in pastas:
+        if not os.path.isdir(pasta): continue
+        for nome in os.listdir(pasta):
+            path = os.path.join(pasta, nome)
+            if not orfao(nome): continue
+            try:
+                if os.path.isdir(path): shutil.rmtree(path)
+                else: os.remove(path)
+                removidos += 1
+            except OSError as e:
+                print(f"⚠️ Não foi possível remover {path}: {e}")
+    return removidos
 
 async def perform_extraction_guild(bot, guild_id: str, target_channels=None, force_all=False):
     cfg = get_config(guild_id)
@@ -368,50 +640,324 @@ async def perform_extraction_guild(bot, guild_id: str, target_channels=None, for
             ch = bot.get_channel(int(cid))
             if ch: channels_obj.append(ch)
 
-    if not channels_obj: return {"canais": 0, "topicos": 0}, None
+    if not channels_obj: return {"canais": 0, "topicos": 0}, [], {}
 
     ts_now = datetime.now(BRT_OFFSET)
-    raiz = f"./temp_backups/{guild_id}_{ts_now.strftime('%H%M%S')}"
     stats = {"canais": 0, "topicos": 0}
-    extracted = False
-
-    async with aiohttp.ClientSession() as session:
-        for ch in channels_obj:
-            cid = str(ch.id)
-            last_ts_str = connected.get(cid, {}).get("last_marker_timestamp")
-            last_ts = datetime.fromisoformat(last_ts_str) if (last_ts_str and not force_all) else None
-            pasta_ch = os.path.join(raiz, clean_name(ch.name))
-            
-            try:
-                threads = [t async for t in ch.archived_threads(limit=None)]
-            except: continue
-
-            cnt = 0
-            for t in threads:
-                # Extrai APENAS se estiver trancado (resolvido/aprovado) e arquivado
-                if not t.locked or not t.archive_timestamp: continue
-                if last_ts and t.archive_timestamp.astimezone(BRT_OFFSET) <= last_ts.astimezone(BRT_OFFSET): continue
-                
-                os.makedirs(pasta_ch, exist_ok=True)
-                # A função extrair_topico agora verifica se está em resolucoes.json
-                if await ExtractionEngine.extrair_topico(bot, session, t, pasta_ch, guild_id):
-                    cnt += 1
-                    extracted = True
-            
-            if cnt > 0:
-                stats["canais"] += 1; stats["topicos"] += cnt
-                def update_marker(data):
-                    if "connected_channels" in data and cid in data["connected_channels"]:
-                        data["connected_channels"][cid]["last_marker_timestamp"] = ts_now.isoformat()
-                    return data
-                await update_config(guild_id, update_marker)
-
-    zip_path = None
-    if extracted:
-        zip_path = shutil.make_archive(raiz, 'zip', raiz)
-        shutil.rmtree(raiz)
-    elif os.path.exists(raiz): shutil.rmtree(raiz)
-    return stats, zip_path
+
+    # Índice thread_id -> resolução carregado UMA vez por execução
+    resolucoes = await DataManager.run_io(load_resolution_index, guild_id)
+    if not resolucoes: return stats, [], {}
+
+    settings = get_extraction_settings(guild_id)
+    modo = settings["modo"]
+    extraidos = []
+    ignoradas = []
+    marcadores = {}  # canal -> arquivamento mais recente já coberto
+    # Aprovações posteriores ao arquivamento só são buscadas por ID a partir do registro de versões
+    # (resoluções mais antigas não têm como ser distinguidas das já extraídas: usar force_all uma vez)
+    versoes_desde = cfg.get("versoes_desde")
+    if not versoes_desde:
+        versoes_desde = ts_now.isoformat()
+        def iniciar_versoes(data):
+            data.setdefault("versoes_desde", versoes_desde)
+            return data
+        await update_config(guild_id, iniciar_versoes)
+    # Tópicos já concluídos por uma execução interrompida do mesmo escopo saem do histórico local
+    journal = await ExtractionJournal.abrir(guild_id, target_channels, force_all)
+    # Tudo vai direto para o pacote, em volumes que cabem no upload; renderização dos TOON e
+    # compressão ficam no processo de empacotamento: o processo do bot só busca e envia.
+    # O sufixo aleatório separa jobs do mesmo servidor no mesmo segundo: a fila libera o servidor
+    # antes do envio, e os volumes de um job ainda podem estar subindo quando o próximo começa
+    nome_pacote = f"{guild_id}_{ts_now.strftime('%H%M%S')}_{uuid.uuid4().hex[:8]}"
+    pacote = archive.ArchiveWriter(os.path.join(TEMP_BACKUPS_DIR, nome_pacote),
+                                   limite_bytes=limite_upload(bot, guild_id),
+                                   formato=settings["formato"], nivel=settings["nivel"],
+                                   processo=EXTRACTION_PACK_PROCESS)
+    session = aiohttp.ClientSession()
+    store = get_blob_store(guild_id)
+    selecao = None
+    mirror = None
+    if settings["anexos"]:
+        mirror = attachments.AttachmentMirror(
+            session, store,
+            max_file_bytes=int(settings["anexo_max_mb"] * 1024 * 1024),
+            max_run_bytes=int(settings["anexos_max_mb_execucao"] * 1024 * 1024),
+            concurrency=settings["anexos_concorrencia"],
+            run_io=DataManager.run_io,
+        )
+    try:
+        if modo == "resolucoes":
+            pendentes = list(resolucoes.values()) if force_all else get_unextracted_resolutions(guild_id, resolucoes)
+            grupos, ignoradas = await buscar_candidatos_por_resolucao(bot, guild_id, channels_obj, pendentes)
+        else:
+            versoes = await DataManager.run_io(load_extracted_versions, guild_id)
+            grupos = {}
+            for ch in channels_obj:
+                last_ts_str = connected.get(str(ch.id), {}).get("last_marker_timestamp")
+                last_ts = datetime.fromisoformat(last_ts_str) if (last_ts_str and not force_all) else None
+                try:
+                    grupos[ch], mais_recente = await listar_candidatos(ch, last_ts, resolucoes, versoes, force_all)
+                except Exception: continue
+                if mais_recente: marcadores[str(ch.id)] = mais_recente
+            if not force_all:
+                # Aprovadas depois de arquivadas (antes do marcador): a listagem não chega nelas
+                listados = {str(t.id) for candidatos in grupos.values() for t in candidatos}
+                atrasadas = [r for r in get_unextracted_resolutions(guild_id, resolucoes, datetime.fromisoformat(versoes_desde))
+                             if r["thread_id"] not in listados]
+                if atrasadas:
+                    encontradas, ignoradas = await buscar_candidatos_por_resolucao(bot, guild_id, channels_obj, atrasadas)
+                    for ch, threads in encontradas.items():
+                        grupos.setdefault(ch, []).extend(threads)
+
+        # Anexos: só os blobs ainda não enviados em pacotes anteriores
+        candidatos_ids = [t.id for candidatos in grupos.values() for t in candidatos]
+        if candidatos_ids:
+            selecao = await DataManager.run_io(attachments.SelecaoAnexos, store, candidatos_ids, force_all)
+
+        for ch, candidatos in grupos.items():
+            extraidos_ch = await extrair_topicos_concorrente(bot, candidatos, pacote, clean_name(ch.name), guild_id,
+                                                             resolucoes, mirror, selecao, journal)
+        
+            if extraidos_ch:
+                stats["canais"] += 1; stats["topicos"] += len(extraidos_ch)
+                extraidos.extend(extraidos_ch)
+                if modo == "resolucoes":
+                    # Sem listagem: o marcador acompanha o arquivamento mais recente extraído
+                    arquivados = [t.archive_timestamp for t, _, _ in extraidos_ch if t.archive_timestamp]
+                    if arquivados: marcadores[str(ch.id)] = max(arquivados)
+
+        if extraidos:
+            volumes_blobs = {b: pacote.volume_index(f"{attachments.ATTACHMENTS_DIRNAME}/{b}") for b in selecao.incluidos}
+            manifesto = await DataManager.run_io(attachments.montar_manifesto, store, [t.id for t, _, _ in extraidos],
+                                                 selecao.incluidos, volumes_blobs)
+            if manifesto:
+                await pacote.add_bytes(attachments.MANIFEST_FILENAME, attachments.manifesto_bytes(manifesto))
+        volumes = await pacote.close()
+    except BaseException:
+        # Erro ou cancelamento (ex.: timeout do backup diário): descarta o pacote parcial
+        # e não avança nenhum marcador; o journal fica, e a próxima execução retoma dos checkpoints
+        await pacote.abort()
+        raise
+    finally:
+        await session.close()
+
+    if mirror: stats["anexos"] = mirror.stats
+    if len(volumes) > 1: stats["volumes"] = len(volumes)
+    if journal.retomados: stats["retomados"] = journal.retomados
+
+    if marcadores:
+        def update_marker(data):
+            for cid, quando in marcadores.items():
+                canal = data.get("connected_channels", {}).get(cid)
+                if canal is None: continue
+                atual = canal.get("last_marker_timestamp")
+                # O marcador só avança (execuções de escopos diferentes podem terminar fora de ordem)
+                if not atual or datetime.fromisoformat(atual) < quando:
+                    canal["last_marker_timestamp"] = quando.isoformat()
+            return data
+        await update_config(guild_id, update_marker)
+    if extraidos:
+        await DataManager.run_io(save_extracted_versions, guild_id,
+                                 [(t.id, t.last_message_id, pacote.volume_of(nome)) for t, _, nome in extraidos], ts_now)
+        await mark_resolutions_extracted(guild_id, [resolucoes[str(t.id)] for t, _, _ in extraidos], ts_now)
+    if ignoradas:
+        print(f"⚠️ [{guild_id}] {len(ignoradas)} resoluções sem tópico acessível nos canais conectados: não serão buscadas de novo.")
+        await mark_resolutions_ignored(guild_id, ignoradas, ts_now)
+    # Blobs só contam como enviados depois do upload do volume (ExtractionJob.confirmar_envio)
+    blobs_por_volume = {}
+    if selecao and selecao.incluidos:
+        for b in selecao.incluidos:
+            blobs_por_volume.setdefault(pacote.volume_of(f"{attachments.ATTACHMENTS_DIRNAME}/{b}"), []).append(b)
+    await journal.fechar()
+    return stats, volumes, blobs_por_volume
+
+# --- ENVIO DOS PACOTES ---
+UPLOAD_MARGIN_BYTES = 512 * 1024         # Folga para o multipart e o texto da mensagem
+DEFAULT_UPLOAD_LIMIT = 10 * 1024 * 1024  # Limite de servidores sem boost
+
+def limite_upload(bot, guild_id: str) -> int:
+    """Tamanho máximo de cada volume, a partir do limite de upload real do servidor"""
+    guild = bot.get_guild(int(guild_id)) if hasattr(bot, "get_guild") else None
+    limite = getattr(guild, "filesize_limit", None) or DEFAULT_UPLOAD_LIMIT
+    return max(1024 * 1024, limite - UPLOAD_MARGIN_BYTES)
+
+async def enviar_volumes(send, texto: str, job, **kwargs) -> None:
+    """
+    Envia os volumes do job em sequência, um por mensagem (os arquivos são da fila de extrações,
+    que os apaga quando o último interessado termina).
+    `send` é o .send de um canal ou interaction.followup.send; kwargs vão para todas as mensagens.
+    Uma falha de envio é avisada na própria conversa (antes era silenciosa); só os volumes
+    enviados marcam os seus anexos como enviados, e só se a mensagem fica no canal: um volume
+    efêmero (ephemeral=True) some para todos, e os anexos dele ficam para o próximo pacote.
+    """
+    persistente = not kwargs.get("ephemeral")
+    total = len(job.volumes)
+    for i, path in enumerate(job.volumes, 1):
+        if total == 1: content = texto
+        elif i == 1: content = f"{texto}\n📚 Volume {i}/{total}"
+        else: content = f"📚 Volume {i}/{total}"
+        try:
+            await send(content, file=discord.File(path), **kwargs)
+        except discord.HTTPException as e:
+            await send(f"❌ Falha ao enviar o volume {i}/{total} ({os.path.basename(path)}): {e}", **kwargs)
+            continue
+        if persistente: await job.confirmar_envio(path)
+
+# --- FILA DE EXTRAÇÕES ---
+# Toda extração passa por aqui. Pedidos do mesmo servidor e escopo (canais + force_all) que
+# chegam com um job na fila ou rodando entram nesse job e recebem o mesmo resultado.
+# Manuais passam na frente dos agendados; um job por servidor extraindo por vez (os marcadores
+# não se sobrepõem; o envio dos volumes acontece fora desse limite) e no máximo
+# EXTRACTION_GLOBAL_CONCURRENCY servidores ao mesmo tempo.
+# O prazo de execução de um job é o do pedido mais tolerante: um pedido manual (sem prazo) que
+# entra num job agendado tira o prazo do backup diário, mesmo com o job já rodando.
+PRIORIDADE_MANUAL = 0
+PRIORIDADE_AGENDADA = 1
+
+class ExtractionJob:
+    def __init__(self, bot, guild_id: str, target_channels, force_all: bool, prioridade: int, timeout: float, chave):
+        self.bot = bot
+        self.guild_id = guild_id
+        self.target_channels = target_channels
+        self.force_all = force_all
+        self.prioridade = prioridade
+        self.timeout = timeout  # Só conta a execução, não a espera na fila (None = sem prazo)
+        self.chave = chave
+        self.future = asyncio.get_running_loop().create_future()
+        self.task = None
+        self.usuarios = 0  # Quem ainda vai usar o resultado (os volumes só são apagados depois do último)
+        self.stats, self.volumes = None, []
+        self.blobs_por_volume = {}  # Nome do volume -> blobs de anexos ainda não confirmados como enviados
+        self.criado = time_mod.perf_counter()
+        self.espera_s = self.duracao_s = None
+        self.api = None  # fetch.Contabilidade.resumo() da execução (também em erro/timeout)
+
+    async def confirmar_envio(self, path: str) -> None:
+        """Volume enviado: os anexos dele não entram mais em pacotes futuros (o primeiro envio basta)"""
+        nome = os.path.basename(path)
+        blobs = self.blobs_por_volume.pop(nome, None)
+        if blobs:
+            await DataManager.run_io(get_blob_store(self.guild_id).marcar_enviados, blobs, nome,
+                                     datetime.now(BRT_OFFSET).isoformat())
+
+    def apagar_volumes(self) -> None:
+        for path in self.volumes:
+            if os.path.exists(path): os.remove(path)
+        self.volumes = []
+
+class ExtractionQueue:
+    def __init__(self, concorrencia: int):
+        self.concorrencia = max(1, concorrencia)
+        self._heap = []                # (prioridade, ordem, job); entradas antigas são ignoradas
+        self._ordem = itertools.count()
+        self._jobs = {}                # (guild_id, escopo) -> job na fila ou rodando
+        self._ocupados = set()         # Servidores com job rodando
+
+    def pendentes(self) -> int:
+        return sum(1 for j in self._jobs.values() if j.task is None)
+
+    def _agendar(self) -> None:
+        adiados = []
+        while self._heap and len(self._ocupados) < self.concorrencia:
+            prioridade, ordem, job = heapq.heappop(self._heap)
+            if job.task is not None or job.future.done() or prioridade != job.prioridade: continue
+            if job.guild_id in self._ocupados:
+                adiados.append((prioridade, ordem, job))
+                continue
+            self._ocupados.add(job.guild_id)
+            job.task = asyncio.create_task(self._executar(job))
+        for entrada in adiados: heapq.heappush(self._heap, entrada)
+
+    async def _executar(self, job: ExtractionJob) -> None:
+        inicio = time_mod.perf_counter()
+        job.espera_s = round(inicio - job.criado, 3)
+        try:
+            # Toda requisição da extração (inclusive das tarefas que ela cria) entra na contabilidade
+            with fetch.contabilizar(get_extraction_pacer(job.guild_id)) as api:
+                try:
+                    coro = perform_extraction_guild(job.bot, job.guild_id, job.target_channels, job.force_all)
+                    job.stats, job.volumes, job.blobs_por_volume = await self._com_prazo(job, coro)
+                finally:
+                    job.api = api.resumo()
+                    if api.chamadas:
+                        print(f"📡 Extração {job.guild_id}: {api.chamadas} chamadas à API, {api.paginas} páginas, "
+                              f"{api.mensagens} mensagens, ~{api.espera_s:.1f}s parado em rate limit ({api.limitadas} respostas 429)")
+            job.future.set_result(job)
+        except asyncio.CancelledError:
+            job.future.cancel()
+        except Exception as e:
+            job.future.set_exception(e)
+        finally:
+            job.duracao_s = round(time_mod.perf_counter() - inicio, 3)
+            if self._jobs.get(job.chave) is job: del self._jobs[job.chave]
+            self._ocupados.discard(job.guild_id)
+            if job.usuarios == 0: job.apagar_volumes()
+            self._agendar()
+
+    @staticmethod
+    async def _com_prazo(job: ExtractionJob, coro):
+        """
+        Como asyncio.wait_for, mas com job.timeout relido a cada expiração:
+        um pedido que entra no meio da execução pode tirar (ou estender) o prazo.
+        """
+        tarefa = asyncio.ensure_future(coro)
+        inicio = time_mod.perf_counter()
+        try:
+            while True:
+                restante = None if job.timeout is None else job.timeout - (time_mod.perf_counter() - inicio)
+                if restante is not None and restante <= 0: raise asyncio.TimeoutError()
+                feitas, _ = await asyncio.wait({tarefa}, timeout=restante)
+                if feitas: return tarefa.result()
+        finally:
+            if not tarefa.done():
+                tarefa.cancel()
+                await asyncio.gather(tarefa, return_exceptions=True)
+
+    def _cancelar(self, job: ExtractionJob) -> None:
+        """Ninguém mais espera o job: cancela a execução (ou tira da fila)"""
+        if job.task is not None:
+            job.task.cancel()
+            return
+        if self._jobs.get(job.chave) is job: del self._jobs[job.chave]
+        job.future.cancel()
+
+    @contextlib.asynccontextmanager
+    async def extrair(self, bot, guild_id, target_channels=None, force_all=False,
+                      prioridade: int = PRIORIDADE_MANUAL, timeout: float = None, metricas: dict = None):
+        """
+        Entra no job do escopo (criando-o se preciso) e entrega o job concluído
+        (.stats, .volumes). Os volumes valem até o fim do bloco `async with`.
+        `metricas`: recebe a espera na fila e a contabilidade da API do job na saída,
+        também quando ele termina em erro ou timeout.
+        """
+        guild_id = str(guild_id)
+        chave = (guild_id, ExtractionJournal.chave(target_channels, force_all))
+        job = self._jobs.get(chave)
+        if job is None:
+            job = self._jobs[chave] = ExtractionJob(bot, guild_id, target_channels, force_all, prioridade, timeout, chave)
+            heapq.heappush(self._heap, (prioridade, next(self._ordem), job))
+        else:
+            if job.task is None and prioridade < job.prioridade:
+                # Pedido manual para um job agendado ainda na fila: sobe de prioridade
+                job.prioridade = prioridade
+                heapq.heappush(self._heap, (prioridade, next(self._ordem), job))
+            if job.timeout is not None and (timeout is None or timeout > job.timeout):
+                job.timeout = timeout
+        job.usuarios += 1
+        self._agendar()
+        try:
+            # shield: quem desiste (ex.: interação cancelada) não derruba o job dos demais
+            await asyncio.shield(job.future)
+            yield job
+        finally:
+            if metricas is not None: metricas.update(espera_s=job.espera_s, api=job.api)
+            job.usuarios -= 1
+            if job.usuarios == 0:
+                if job.future.done(): job.apagar_volumes()
+                else: self._cancelar(job)
+
+EXTRACTION_QUEUE = ExtractionQueue(EXTRACTION_GLOBAL_CONCURRENCY)
 
 # --- DECORATORS & PERMISSÕES ---
 
@@ -448,21 +994,55 @@ async def daily_extraction_loop():
     if not _bot_instance: return
     active_guilds = get_all_active_guilds()
     print(f"🔄 Iniciando backup diário para {len(active_guilds)} servidores.")
-    
-    for guild_id in active_guilds:
-        try:
-            log_channel_id = get_setup_id(int(guild_id), "id_canal_comandos")
-            if not log_channel_id: continue
-            
-            stats, zip_path = await perform_extraction_guild(_bot_instance, guild_id)
-            
-            ch = _bot_instance.get_channel(log_channel_id)
-            if ch:
-                if zip_path:
-                    await ch.send(f"📦 **Backup Auto**\nNovos: {stats['topicos']}", file=discord.File(zip_path))
-                    os.remove(zip_path)
-                else: await ch.send("✅ Backup diário: Nada novo.")
-        except Exception as e: print(f"❌ Erro backup {guild_id}: {e}")
+
+    # O teto global de servidores simultâneos é da fila; cada servidor roda isolado
+    # (erro/timeout não afeta os demais) e pedidos manuais passam na frente
+    inicio = time_mod.perf_counter()
+    inicio_ts = datetime.now(BRT_OFFSET)
+    resultados = await asyncio.gather(*(_backup_diario_guild(guild_id) for guild_id in active_guilds))
+
+    total = time_mod.perf_counter() - inicio
+    DAILY_RUN_METRICS.clear()
+    DAILY_RUN_METRICS.update({
+        "inicio": inicio_ts.isoformat(),
+        "total_s": round(total, 3),
+        "guilds": dict(zip(active_guilds, resultados)),
+    })
+    falhas = sum(1 for r in resultados if r["status"] in ("erro", "timeout"))
+    lenta = max(DAILY_RUN_METRICS["guilds"].items(), key=lambda kv: kv[1]["duracao_s"], default=None)
+    parado = sum(r["api"]["espera_s"] for r in resultados if r["api"])
+    print(f"✅ Backup diário concluído em {total:.1f}s ({len(active_guilds)} servidores, {falhas} com falha)"
+          + (f" | mais lento: {lenta[0]} ({lenta[1]['duracao_s']:.1f}s)" if lenta else "")
+          + (f" | ~{parado:.1f}s parado em rate limit" if parado else ""))
+
+async def _backup_diario_guild(guild_id: str) -> dict:
+    """Backup diário de UM servidor: extração (pela fila, com timeout próprio) + envio. Nunca levanta exceção."""
+    inicio = time_mod.perf_counter()
+    status = "ok"
+    metricas = {"espera_s": None, "api": None}
+    try:
+        await _executar_backup_diario(guild_id, metricas)
+    except asyncio.TimeoutError:
+        status = "timeout"
+        print(f"⏱️ Backup {guild_id} excedeu {DAILY_GUILD_TIMEOUT:.0f}s e foi cancelado.")
+    except Exception as e:
+        status = "erro"
+        print(f"❌ Erro backup {guild_id}: {e}")
+    duracao = time_mod.perf_counter() - inicio
+    return {"status": status, "duracao_s": round(duracao - (metricas["espera_s"] or 0), 3), **metricas}
+
+async def _executar_backup_diario(guild_id: str, metricas: dict) -> None:
+    """Preenche `metricas` com a espera na fila e a contabilidade da API do job (também em erro/timeout)"""
+    log_channel_id = get_setup_id(int(guild_id), "id_canal_comandos")
+    if not log_channel_id: return
+
+    async with EXTRACTION_QUEUE.extrair(_bot_instance, guild_id, prioridade=PRIORIDADE_AGENDADA,
+                                        timeout=DAILY_GUILD_TIMEOUT, metricas=metricas) as job:
+        ch = _bot_instance.get_channel(log_channel_id)
+        if ch:
+            if job.volumes:
+                await enviar_volumes(ch.send, f"📦 **Backup Auto**\nNovos: {job.stats['topicos']}", job)
+            else: await ch.send("✅ Backup diário: Nada novo.")
 
 @tasks.loop(minutes=1)
 async def update_countdown_loop():
@@ -539,11 +1119,10 @@ def setup_commands(bot):
             await interaction.response.send_message(f"❌ Use no canal <#{cmd_channel_id}>.", ephemeral=True)
             return
         await interaction.response.defer()
-        stats, zip_path = await perform_extraction_guild(bot, str(interaction.guild.id))
-        if zip_path:
-            await interaction.followup.send(f"📦 **Backup Global**: {stats['topicos']} tópicos.", file=discord.File(zip_path))
-            os.remove(zip_path)
-        else: await interaction.followup.send("✅ Backup Global: Nada novo.")
+        async with EXTRACTION_QUEUE.extrair(bot, interaction.guild.id) as job:
+            if job.volumes:
+                await enviar_volumes(interaction.followup.send, f"📦 **Backup Global**: {job.stats['topicos']} tópicos.", job)
+            else: await interaction.followup.send("✅ Backup Global: Nada novo.")
 
     @bot.tree.command(name="resolvido", description="[SUPORTE] Solicita finalização e aprovação.")
     @check_permission("resolvido")
@@ -0,0 +1,227 @@
+"""
+fetch.py - Camada de busca da extração (API do Discord) com contabilidade e ritmo adaptativo
+Os 429 e os buckets continuam com o discord.py; aqui cada requisição HTTP do bot é observada
+(aiohttp.TraceConfig, registrado via http_trace em main.py) e atribuída à extração em andamento
+(contextvars): chamadas, páginas, mensagens e uma estimativa do tempo parado em rate limit, por rota.
+As mesmas respostas ajustam o RitmoAdaptativo, que limita quantos tópicos do servidor são lidos
+ao mesmo tempo. Só depende das respostas HTTP: qualquer servidor falso no lugar da API
+(Route.BASE) exercita a camada inteira.
+"""
+import re
+import time
+import asyncio
+import contextlib
+import contextvars
+import aiohttp
+
+# Listagens paginadas: histórico de mensagens e tópicos arquivados
+ROTAS_PAGINADAS = re.compile(r"/channels/\d+/(messages|(users/@me/)?threads/archived/\w+)$")
+# Parâmetro principal do bucket (o mesmo X-RateLimit-Bucket vale separado por canal/servidor)
+PARAMETRO_PRINCIPAL = re.compile(r"/(channels|guilds|webhooks)/(\d+)")
+# Abaixo desta fração da cota (X-RateLimit-Remaining / X-RateLimit-Limit) o bucket está apertado
+FOLGA_MINIMA = 0.25
+
+_ATUAL = contextvars.ContextVar("contabilidade_api", default=None)
+
+
+def rota_de(metodo: str, path: str) -> str:
+    """Rota sem a versão da API e sem IDs: "GET /channels/{id}/messages" """
+    path = re.sub(r"/\d+", "/{id}", re.sub(r"^/api/v\d+", "", path))
+    return f"{metodo} {path}"
+
+def _bucket_de(path: str, headers):
+    bucket = headers.get("X-RateLimit-Bucket")
+    if not bucket: return None
+    principal = PARAMETRO_PRINCIPAL.search(path)
+    return f"{bucket}:{principal.group(2)}" if principal else bucket
+
+def _numero(valor, tipo=int):
+    try:
+        return tipo(valor) if valor is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def _espera(status: int, headers) -> float:
+    """Espera anunciada pela resposta (429, ou bucket esgotado): o teto da espera real"""
+    if status == 429:
+        valor = headers.get("X-RateLimit-Reset-After") or headers.get("Retry-After")
+    elif headers.get("X-RateLimit-Remaining") == "0":
+        valor = headers.get("X-RateLimit-Reset-After")
+    else:
+        return 0.0
+    try:
+        return max(0.0, float(valor))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+# --- RITMO ADAPTATIVO ---
+
+class RitmoAdaptativo:
+    """
+    Semáforo de limite variável (AIMD) guiado pela folga de cada bucket de rate limit:
+    - 429: o limite cai pela metade;
+    - bucket esgotado (Remaining 0): o limite cai 1, uma vez por janela do bucket;
+    - bucket abaixo de FOLGA_MINIMA da cota: o limite fica parado até a janela dele reiniciar;
+    - a cada `limite` respostas seguidas sem nenhum bucket apertado, o limite sobe 1, até o máximo.
+    """
+
+    def __init__(self, maximo: int):
+        self.maximo = maximo
+        self.limite = maximo
+        self.em_uso = 0
+        self._seguidas = 0
+        self._apertados = {}  # bucket -> (fim da janela, esgotado)
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.em_uso < self.limite)
+            self.em_uso += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        async with self._cond:
+            self.em_uso -= 1
+            self._cond.notify_all()
+
+    def _apertado(self, bucket, restante, cota, reset_after) -> bool:
+        """Atualiza o estado do bucket; True se ele acabou de esgotar (nesta janela)"""
+        agora = time.monotonic()
+        for b, (fim, _) in list(self._apertados.items()):
+            if fim <= agora: del self._apertados[b]
+        if bucket is None or restante is None or not cota: return False
+        if restante >= cota * FOLGA_MINIMA:
+            self._apertados.pop(bucket, None)
+            return False
+        esgotou = restante == 0 and not self._apertados.get(bucket, (0, False))[1]
+        self._apertados[bucket] = (agora + (reset_after or 1.0), restante == 0)
+        return esgotou
+
+    async def observar(self, status: int, restante, cota=None, bucket=None, reset_after=None) -> None:
+        esgotou = self._apertado(bucket, restante, cota, reset_after)
+        if status == 429:
+            self.limite = max(1, self.limite // 2)
+            self._seguidas = 0
+        elif esgotou or restante == 0:
+            if esgotou: self.limite = max(1, self.limite - 1)
+            self._seguidas = 0
+        elif self._apertados:
+            self._seguidas = 0
+        elif status is not None and status < 400:
+            self._seguidas += 1
+            if self._seguidas >= self.limite and self.limite < self.maximo:
+                self.limite += 1
+                self._seguidas = 0
+                async with self._cond:
+                    self._cond.notify_all()
+
+
+# --- CONTABILIDADE ---
+
+class Contabilidade:
+    """Números da API de uma extração; `ritmo` (opcional) recebe as mesmas respostas"""
+
+    def __init__(self, ritmo: RitmoAdaptativo = None):
+        self.ritmo = ritmo
+        self.chamadas = 0
+        self.paginas = 0
+        self.mensagens = 0
+        self.limitadas = 0   # Respostas 429
+        # Estimativa do tempo parado em rate limit, somado entre as tarefas: depois de um 429 ou de
+        # um bucket esgotado, o intervalo até a próxima requisição do mesmo caminho, limitado à
+        # espera anunciada (sem requisição seguinte, nada é contado)
+        self.espera_s = 0.0
+        self.rotas = {}      # rota -> {"chamadas", "limitadas", "espera_s", "restante_min"}
+        self._bloqueios = {}  # (método, caminho) -> (fim da resposta, espera anunciada)
+
+    def _rota(self, rota: str) -> dict:
+        return self.rotas.setdefault(rota, {"chamadas": 0, "limitadas": 0, "espera_s": 0.0, "restante_min": None})
+
+    def iniciar(self, metodo: str, path: str) -> None:
+        """Início de uma requisição: fecha a espera pendente do mesmo caminho, se houver"""
+        bloqueio = self._bloqueios.pop((metodo, path), None)
+        if bloqueio is None: return
+        fim, anunciada = bloqueio
+        espera = min(anunciada, time.monotonic() - fim)
+        self.espera_s += espera
+        self._rota(rota_de(metodo, path))["espera_s"] += espera
+
+    async def registrar(self, metodo: str, path: str, status: int, headers) -> None:
+        r = self._rota(rota_de(metodo, path))
+        restante = _numero(headers.get("X-RateLimit-Remaining"))
+        anunciada = _espera(status, headers) if status is not None else 0.0
+        if anunciada: self._bloqueios[(metodo, path)] = (time.monotonic(), anunciada)
+
+        self.chamadas += 1
+        r["chamadas"] += 1
+        if status == 429:
+            self.limitadas += 1
+            r["limitadas"] += 1
+        elif metodo == "GET" and status == 200 and ROTAS_PAGINADAS.search(path):
+            self.paginas += 1
+        if restante is not None and (r["restante_min"] is None or restante < r["restante_min"]):
+            r["restante_min"] = restante
+        if self.ritmo:
+            await self.ritmo.observar(status, restante, _numero(headers.get("X-RateLimit-Limit")),
+                                      _bucket_de(path, headers), _numero(headers.get("X-RateLimit-Reset-After"), float))
+
+    def resumo(self) -> dict:
+        return {
+            "chamadas": self.chamadas, "paginas": self.paginas, "mensagens": self.mensagens,
+            "limitadas": self.limitadas, "espera_s": round(self.espera_s, 3),
+            "concorrencia": self.ritmo.limite if self.ritmo else None,
+            "rotas": {k: {**v, "espera_s": round(v["espera_s"], 3)} for k, v in self.rotas.items()},
+        }
+
+@contextlib.contextmanager
+def contabilizar(ritmo: RitmoAdaptativo = None):
+    """Atribui à Contabilidade as requisições desta tarefa e das tarefas criadas dentro do bloco"""
+    cont = Contabilidade(ritmo)
+    token = _ATUAL.set(cont)
+    try:
+        yield cont
+    finally:
+        _ATUAL.reset(token)
+
+def registrar_inicio(metodo: str, path: str) -> None:
+    cont = _ATUAL.get()
+    if cont is not None: cont.iniciar(metodo, path)
+
+async def registrar_resposta(metodo: str, path: str, status: int, headers) -> None:
+    """Entrada da observação (também para servidores falsos): status None = falha de conexão"""
+    cont = _ATUAL.get()
+    if cont is not None: await cont.registrar(metodo, path, status, headers)
+
+def trace_config() -> aiohttp.TraceConfig:
+    """Passar como http_trace do bot"""
+    trace = aiohttp.TraceConfig()
+
+    async def inicio(session, ctx, params):
+        registrar_inicio(params.method, params.url.path)
+
+    async def fim(session, ctx, params):
+        await registrar_resposta(params.method, params.url.path, params.response.status, params.response.headers)
+
+    async def falha(session, ctx, params):
+        await registrar_resposta(params.method, params.url.path, None, {})
+
+    trace.on_request_start.append(inicio)
+    trace.on_request_end.append(fim)
+    trace.on_request_exception.append(falha)
+    return trace
+
+
+# --- BUSCAS ---
+
+async def historico(thread, after=None):
+    """thread.history do mais antigo para o mais novo, contando as mensagens lidas"""
+    cont = _ATUAL.get()
+    async for m in thread.history(limit=None, after=after, oldest_first=True):
+        if cont is not None: cont.mensagens += 1
+        yield m
+
+async def arquivados(channel):
+    """channel.archived_threads, do arquivamento mais recente para o mais antigo"""
+    async for t in channel.archived_threads(limit=None):
+        yield t
@@ -8,7 +8,13 @@ import traceback
 from dotenv import load_dotenv
 
 # Importações dos módulos locais
-from extraction import setup_commands, setup_events, set_bot, daily_extraction_loop, update_countdown_loop
+from extraction import (
+    setup_commands, setup_events, set_bot, daily_extraction_loop, update_countdown_loop, limpar_orfaos_extracao
+)
+from config import DataManager, close_storage, init_guild_registry, EXTRACTION_PACK_PROCESS, EXTRACTION_PACK_WORKERS
+import audit_log
+import archive
+import fetch
 
 # Carrega variáveis de ambiente (.env)
 load_dotenv()
@@ -20,7 +26,8 @@ intents.messages = True
 intents.message_content = True  
 intents.members = True          
 
-bot = commands.Bot(command_prefix="!", intents=intents)
+# http_trace: contabilidade das chamadas à API por extração (fetch.py)
+bot = commands.Bot(command_prefix="!", intents=intents, http_trace=fetch.trace_config())
 
 # --- EVENTOS GERAIS ---
 @bot.event
@@ -51,6 +58,16 @@ def main():
     """Função de entrada"""
     # Define a referência do bot no módulo extraction
     set_bot(bot)
+
+    # Registro de servidores em memória (única varredura de ./dados_servidores)
+    print(f"📂 {len(init_guild_registry())} servidores com dados.")
+
+    # Restos de extrações interrompidas por uma queda (os jobs em si são retomados)
+    removidos = limpar_orfaos_extracao()
+    if removidos: print(f"🧹 {removidos} arquivos temporários de extrações interrompidas removidos.")
+
+    # Processos de empacotamento: sobem uma vez aqui e atendem todos os backups
+    if EXTRACTION_PACK_PROCESS: archive.iniciar_processos(EXTRACTION_PACK_WORKERS)
     
     # Configura eventos e comandos
     setup_events(bot)
@@ -72,6 +89,12 @@ def main():
     except Exception as e:
         print(f"\n❌ Erro fatal ao executar bot: {e}")
         traceback.print_exc()
+    finally:
+        DataManager.flush_all_sync()
+        DataManager.shutdown_io()
+        archive.encerrar_processos()
+        audit_log.close()
+        close_storage()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
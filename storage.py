@@ -0,0 +1,499 @@
+"""
+storage.py - Backends de armazenamento por servidor (JSON, SQLite ou memória)
+O backend é escolhido pela variável de ambiente STORAGE_BACKEND (json | sqlite | memory).
+
+Tipos de dado (pelo nome):
+    Documentos  ("config", "categorias"): um dict por servidor
+    Coleções    ("resolucoes", "pendencias"): registros chaveados por thread_id
+    Listas      (qualquer outro nome, ex.: "logs"): entradas em ordem de inserção
+"""
+import os
+import copy
+import json
+import sqlite3
+import tempfile
+import threading
+from typing import Protocol, Callable, Any
+
+DB_FILENAME = "dados.db"
+DEFAULT_BACKEND = "sqlite"
+
+# Coleções chaveadas: nome -> (campo chave, colunas)
+KEYED_COLLECTIONS = {
+    "resolucoes": ("thread_id", ("data", "thread_id", "thread_nome", "resolvido_por",
+                                 "resolvido_por_id", "orgao", "categoria", "extraido_em",
+                                 "ignorado_em")),
+    "pendencias": ("thread_id", ("data_solicitacao", "thread_id", "thread_nome", "canal_origem",
+                                 "resolvido_por", "resolvido_por_id", "orgao", "categoria")),
+    # Cursor da extração incremental: último ID lido e tamanho do histórico já renderizado
+    "cursores": ("thread_id", ("thread_id", "last_id", "mensagens", "tamanho", "atualizado")),
+    # Anexos espelhados: attachment_id -> blob (hash do conteúdo) e o registro de envio de cada blob
+    "anexos": ("attachment_id", ("attachment_id", "blob", "tamanho", "nome", "thread_id")),
+    "blobs": ("blob", ("blob", "tamanho", "enviado_em", "arquivo")),
+    # Versão de cada tópico que foi para um pacote ("thread_id:last_id")
+    "versoes": ("versao", ("versao", "thread_id", "last_id", "extraido_em", "pacote")),
+    # Journal das extrações: jobs em andamento e os tópicos já concluídos em cada um ("job:thread_id")
+    "extracoes": ("job", ("job", "iniciado_em")),
+    "checkpoints": ("checkpoint", ("checkpoint", "job", "thread_id", "last_id", "versao", "concluido_em")),
+}
+DOCUMENTS = ("config", "categorias")
+
+_KNOWN_FOLDERS = set()
+
+def ensure_folder(folder: str) -> bool:
+    """Cria a pasta uma única vez por processo; retorna True se ela acabou de ser conhecida"""
+    if folder in _KNOWN_FOLDERS: return False
+    os.makedirs(folder, exist_ok=True)
+    _KNOWN_FOLDERS.add(folder)
+    return True
+
+def mark_folder_known(folder: str) -> None:
+    """Registra uma pasta já existente (ex.: encontrada na varredura inicial)"""
+    _KNOWN_FOLDERS.add(folder)
+
+def _normalizar(entry: dict, col: str):
+    """IDs sempre como string (alguns JSON antigos guardavam como int)"""
+    val = entry.get(col)
+    if val is not None and col.endswith("_id"):
+        return str(val)
+    return val
+
+def atomic_write_json(filepath: str, data, fsync: bool = True) -> None:
+    """
+    Escreve JSON de forma ATÔMICA (Safe Write).
+    1. Escreve num arquivo temporário.
+    2. Renomeia para o arquivo final.
+    """
+    dir_name = os.path.dirname(filepath)
+    # Cria arquivo temporário na mesma pasta
+    with tempfile.NamedTemporaryFile("w", dir=dir_name, delete=False, encoding="utf-8") as tmp_file:
+        json.dump(data, tmp_file, indent=4, ensure_ascii=False)
+        tmp_file.flush()
+        if fsync:
+            os.fsync(tmp_file.fileno()) # Garante que foi escrito no disco
+        tmp_path = tmp_file.name
+
+    # Substituição atômica
+    try:
+        os.replace(tmp_path, filepath)
+    except OSError as e:
+        print(f"❌ Erro ao salvar arquivo {filepath}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class StorageBackend(Protocol):
+    """Contrato comum a todos os backends (chamadas síncronas, feitas a partir do executor)"""
+
+    def get(self, guild_id: str, name: str, default=None) -> Any: ...
+    def put(self, guild_id: str, name: str, data, durable: bool = True) -> None: ...
+    def update(self, guild_id: str, name: str, callback: Callable, default=None) -> Any: ...
+    def append(self, guild_id: str, name: str, item: dict, max_items: int = None) -> None: ...
+    def get_item(self, guild_id: str, name: str, key: str) -> dict: ...
+    def upsert(self, guild_id: str, name: str, item: dict, move_to_end: bool = False) -> None: ...
+    def remove(self, guild_id: str, name: str, key: str) -> bool: ...
+    def version(self, guild_id: str, name: str) -> Any: ...
+    def close(self) -> None: ...
+
+
+# --- BACKEND: ARQUIVOS JSON (formato original) ---
+
+class JsonFileBackend:
+    """Um arquivo {name}.json por servidor; toda escrita reescreve o arquivo inteiro"""
+
+    def __init__(self, base_path: str):
+        self.base_path = base_path
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _path(self, guild_id: str, name: str) -> str:
+        folder = os.path.join(self.base_path, str(guild_id))
+        ensure_folder(folder)
+        return os.path.join(folder, f"{name}.json")
+
+    def _lock(self, guild_id: str, name: str) -> threading.Lock:
+        key = (str(guild_id), name)
+        with self._locks_guard:
+            if key not in self._locks:
+                self._locks[key] = threading.Lock()
+            return self._locks[key]
+
+    def _read(self, path: str, default):
+        if not os.path.exists(path):
+            return default
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            print(f"⚠️ Arquivo corrompido detectado: {path}. Retornando padrão.")
+            return default
+
+    def get(self, guild_id, name, default=None):
+        path = self._path(guild_id, name)
+        if default is None and name not in DOCUMENTS: default = []
+        if not os.path.exists(path) and default is not None and name in DOCUMENTS:
+            atomic_write_json(path, default)
+        return self._read(path, default)
+
+    def put(self, guild_id, name, data, durable=True):
+        with self._lock(guild_id, name):
+            atomic_write_json(self._path(guild_id, name), data, fsync=durable)
+
+    def update(self, guild_id, name, callback, default=None):
+        with self._lock(guild_id, name):
+            path = self._path(guild_id, name)
+            new_data = callback(self._read(path, default))
+            atomic_write_json(path, new_data)
+            return new_data
+
+    def append(self, guild_id, name, item, max_items=None):
+        def _add(items):
+            items = items or []
+            items.append(item)
+            return items[-max_items:] if max_items else items
+        self.update(guild_id, name, _add, [])
+
+    def get_item(self, guild_id, name, key):
+        key_field = KEYED_COLLECTIONS[name][0]
+        return next((i for i in self.get(guild_id, name, []) if str(i.get(key_field)) == str(key)), None)
+
+    def upsert(self, guild_id, name, item, move_to_end=False):
+        key_field = KEYED_COLLECTIONS[name][0]
+        key = str(item[key_field])
+        def _upsert(items):
+            items = items or []
+            entry = next((i for i in items if str(i.get(key_field)) == key), None)
+            if entry and not move_to_end:
+                entry.update(item)
+            else:
+                items = [i for i in items if str(i.get(key_field)) != key]
+                items.append(item)
+            return items
+        self.update(guild_id, name, _upsert, [])
+
+    def remove(self, guild_id, name, key):
+        key_field = KEYED_COLLECTIONS[name][0]
+        with self._lock(guild_id, name):
+            path = self._path(guild_id, name)
+            items = self._read(path, [])
+            novo = [i for i in items if str(i.get(key_field)) != str(key)]
+            if len(novo) < len(items):
+                atomic_write_json(path, novo)
+                return True
+        return False
+
+    def version(self, guild_id, name):
+        try:
+            return os.stat(os.path.join(self.base_path, str(guild_id), f"{name}.json")).st_mtime_ns
+        except OSError:
+            return None
+
+    def close(self):
+        pass
+
+
+# --- BACKEND: SQLITE (um banco WAL por servidor) ---
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documentos (
+    nome TEXT PRIMARY KEY,
+    dados TEXT
+);
+CREATE TABLE IF NOT EXISTS listas (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    nome TEXT,
+    dados TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_listas_nome ON listas (nome, id);
+CREATE TABLE IF NOT EXISTS meta (
+    chave TEXT PRIMARY KEY,
+    valor TEXT
+);
+""" + "".join(
+    f"CREATE TABLE IF NOT EXISTS {name} ({', '.join(c + (' TEXT PRIMARY KEY' if c == key else ' TEXT') for c in cols)});\n"
+    for name, (key, cols) in KEYED_COLLECTIONS.items()
+)
+
+
+class GuildDB:
+    """Conexão SQLite de um servidor (thread-safe, usada a partir do executor)"""
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.path = os.path.join(folder, DB_FILENAME)
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")  # Mesma durabilidade do antigo fsync
+        self.conn.executescript(_SQLITE_SCHEMA)
+        self.migrar_colunas()
+        self.importar_json_legado()
+
+    def migrar_colunas(self) -> None:
+        """Acrescenta às tabelas existentes as colunas novas de KEYED_COLLECTIONS"""
+        with self.lock:
+            for name, (_, cols) in KEYED_COLLECTIONS.items():
+                existentes = {r["name"] for r in self.conn.execute(f"PRAGMA table_info({name})")}
+                for c in cols:
+                    if c not in existentes:
+                        self.conn.execute(f"ALTER TABLE {name} ADD COLUMN {c} TEXT")
+
+    def transaction(self):
+        return _Transaction(self)
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+    def importar_json_legado(self) -> bool:
+        """
+        Importa (uma única vez) resolucoes.json e pendencias.json da pasta do servidor.
+        Os arquivos JSON são mantidos intactos como backup.
+        """
+        with self.lock:
+            if self.conn.execute("SELECT 1 FROM meta WHERE chave = 'json_importado'").fetchone():
+                return False
+
+        def _ler(nome):
+            path = os.path.join(self.folder, nome)
+            if not os.path.exists(path): return []
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                return data if isinstance(data, list) else []
+            except (OSError, json.JSONDecodeError):
+                print(f"⚠️ Não foi possível importar {path}.")
+                return []
+
+        totais = {}
+        with self.transaction() as conn:
+            for name, (key, cols) in KEYED_COLLECTIONS.items():
+                items = [i for i in _ler(f"{name}.json") if i.get(key)]
+                for i in items:
+                    conn.execute(
+                        f"INSERT OR REPLACE INTO {name} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+                        [_normalizar(i, c) for c in cols]
+                    )
+                totais[name] = len(items)
+            conn.execute("INSERT INTO meta (chave, valor) VALUES ('json_importado', '1')")
+
+        if any(totais.values()):
+            print(f"📥 {self.folder}: importadas {totais['resolucoes']} resoluções e {totais['pendencias']} pendências.")
+        return True
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK segurando o lock da conexão"""
+    def __init__(self, db: GuildDB):
+        self.db = db
+
+    def __enter__(self):
+        self.db.lock.acquire()
+        self.db.conn.execute("BEGIN IMMEDIATE")
+        return self.db.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.db.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.db.lock.release()
+        return False
+
+
+class SQLiteBackend:
+    """Coleções em tabelas com chave primária; documentos e listas serializados em JSON"""
+
+    def __init__(self, base_path: str):
+        self.base_path = base_path
+        self._dbs = {}
+        self._dbs_lock = threading.Lock()
+
+    def db(self, guild_id: str) -> GuildDB:
+        guild_id = str(guild_id)
+        db = self._dbs.get(guild_id)
+        if db is None:
+            with self._dbs_lock:
+                db = self._dbs.get(guild_id)
+                if db is None:
+                    folder = os.path.join(self.base_path, guild_id)
+                    ensure_folder(folder)
+                    db = self._dbs[guild_id] = GuildDB(folder)
+        return db
+
+    def _rows(self, guild_id, sql, params=()) -> list:
+        db = self.db(guild_id)
+        with db.lock:
+            return [dict(r) for r in db.conn.execute(sql, params).fetchall()]
+
+    def get(self, guild_id, name, default=None):
+        if name in KEYED_COLLECTIONS:
+            return self._rows(guild_id, f"SELECT * FROM {name} ORDER BY rowid")
+        if name in DOCUMENTS:
+            rows = self._rows(guild_id, "SELECT dados FROM documentos WHERE nome = ?", (name,))
+            return json.loads(rows[0]["dados"]) if rows else default
+        rows = self._rows(guild_id, "SELECT dados FROM listas WHERE nome = ? ORDER BY id", (name,))
+        return [json.loads(r["dados"]) for r in rows] if rows else (default if default is not None else [])
+
+    def _put(self, conn, name, data) -> None:
+        if name in KEYED_COLLECTIONS:
+            cols = KEYED_COLLECTIONS[name][1]
+            conn.execute(f"DELETE FROM {name}")
+            conn.executemany(
+                f"INSERT INTO {name} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+                [[_normalizar(i, c) for c in cols] for i in data]
+            )
+        elif name in DOCUMENTS:
+            conn.execute("INSERT OR REPLACE INTO documentos (nome, dados) VALUES (?, ?)",
+                         (name, json.dumps(data, ensure_ascii=False)))
+        else:
+            conn.execute("DELETE FROM listas WHERE nome = ?", (name,))
+            conn.executemany("INSERT INTO listas (nome, dados) VALUES (?, ?)",
+                             [(name, json.dumps(i, ensure_ascii=False)) for i in data])
+
+    def put(self, guild_id, name, data, durable=True):
+        with self.db(guild_id).transaction() as conn:
+            self._put(conn, name, data)
+
+    def update(self, guild_id, name, callback, default=None):
+        db = self.db(guild_id)
+        with db.transaction() as conn:
+            new_data = callback(self.get(guild_id, name, default))
+            self._put(conn, name, new_data)
+            return new_data
+
+    def append(self, guild_id, name, item, max_items=None):
+        with self.db(guild_id).transaction() as conn:
+            conn.execute("INSERT INTO listas (nome, dados) VALUES (?, ?)",
+                         (name, json.dumps(item, ensure_ascii=False)))
+            if max_items:
+                # Rotação: mantém apenas os últimos max_items (usa o índice (nome, id))
+                conn.execute(
+                    "DELETE FROM listas WHERE nome = ? AND id <= "
+                    "(SELECT id FROM listas WHERE nome = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (name, name, max_items)
+                )
+
+    def get_item(self, guild_id, name, key):
+        key_field = KEYED_COLLECTIONS[name][0]
+        rows = self._rows(guild_id, f"SELECT * FROM {name} WHERE {key_field} = ?", (str(key),))
+        return rows[0] if rows else None
+
+    def upsert(self, guild_id, name, item, move_to_end=False):
+        key_field, cols = KEYED_COLLECTIONS[name]
+        values = [_normalizar(item, c) for c in cols]
+        placeholders = ", ".join("?" * len(cols))
+        if move_to_end:
+            # REPLACE remove e reinsere: o registro vai para o fim da ordem de inserção
+            sql = f"INSERT OR REPLACE INTO {name} ({', '.join(cols)}) VALUES ({placeholders})"
+        else:
+            sets = ", ".join(f"{c}=excluded.{c}" for c in cols if c != key_field)
+            sql = (f"INSERT INTO {name} ({', '.join(cols)}) VALUES ({placeholders}) "
+                   f"ON CONFLICT({key_field}) DO UPDATE SET {sets}")
+        with self.db(guild_id).transaction() as conn:
+            conn.execute(sql, values)
+
+    def remove(self, guild_id, name, key):
+        key_field = KEYED_COLLECTIONS[name][0]
+        with self.db(guild_id).transaction() as conn:
+            return conn.execute(f"DELETE FROM {name} WHERE {key_field} = ?", (str(key),)).rowcount > 0
+
+    def version(self, guild_id, name):
+        return None  # Único escritor é o próprio bot: o cache nunca fica obsoleto
+
+    def close(self):
+        with self._dbs_lock:
+            for db in self._dbs.values():
+                db.close()
+            self._dbs.clear()
+
+
+# --- BACKEND: MEMÓRIA (testes e benchmarks; nada é persistido) ---
+
+class MemoryBackend:
+    def __init__(self, base_path: str = None):
+        self._data = {}
+        self._lock = threading.RLock()
+
+    def get(self, guild_id, name, default=None):
+        with self._lock:
+            val = self._data.get((str(guild_id), name))
+            if val is None:
+                return default if default is not None or name in DOCUMENTS else []
+            return copy.deepcopy(list(val.values()) if name in KEYED_COLLECTIONS else val)
+
+    def put(self, guild_id, name, data, durable=True):
+        data = copy.deepcopy(data)
+        if name in KEYED_COLLECTIONS:
+            key_field = KEYED_COLLECTIONS[name][0]
+            data = {str(i[key_field]): i for i in data}
+        with self._lock:
+            self._data[(str(guild_id), name)] = data
+
+    def update(self, guild_id, name, callback, default=None):
+        with self._lock:
+            new_data = callback(self.get(guild_id, name, default))
+            self.put(guild_id, name, new_data)
+            return new_data
+
+    def append(self, guild_id, name, item, max_items=None):
+        with self._lock:
+            items = self._data.setdefault((str(guild_id), name), [])
+            items.append(copy.deepcopy(item))
+            if max_items and len(items) > max_items:
+                del items[:len(items) - max_items]
+
+    def get_item(self, guild_id, name, key):
+        with self._lock:
+            return copy.deepcopy(self._data.get((str(guild_id), name), {}).get(str(key)))
+
+    def upsert(self, guild_id, name, item, move_to_end=False):
+        key_field = KEYED_COLLECTIONS[name][0]
+        key = str(item[key_field])
+        with self._lock:
+            items = self._data.setdefault((str(guild_id), name), {})
+            if move_to_end or key not in items:
+                items.pop(key, None)
+                items[key] = copy.deepcopy(item)
+            else:
+                items[key].update(copy.deepcopy(item))
+
+    def remove(self, guild_id, name, key):
+        with self._lock:
+            return self._data.get((str(guild_id), name), {}).pop(str(key), None) is not None
+
+    def version(self, guild_id, name):
+        return None
+
+    def close(self):
+        pass
+
+
+BACKENDS = {
+    "json": JsonFileBackend,
+    "sqlite": SQLiteBackend,
+    "memory": MemoryBackend,
+}
+
+def create_backend(kind: str, base_path: str) -> StorageBackend:
+    kind = (kind or DEFAULT_BACKEND).lower()
+    if kind not in BACKENDS:
+        raise ValueError(f"STORAGE_BACKEND inválido: {kind} (use {', '.join(BACKENDS)})")
+    return BACKENDS[kind](base_path)
+
+def importar_todos(base_path: str) -> int:
+    """Importador one-shot: migra os JSON legados de todos os servidores para o SQLite"""
+    if not os.path.exists(base_path): return 0
+    backend = SQLiteBackend(base_path)
+    total = 0
+    for d in sorted(os.listdir(base_path)):
+        if d.isdigit() and os.path.isdir(os.path.join(base_path, d)):
+            backend.db(d)  # A abertura dispara a importação, se ainda não feita
+            total += 1
+    backend.close()
+    return total
+
+if __name__ == "__main__":
+    from config import BASE_DATA_PATH
+    n = importar_todos(BASE_DATA_PATH)
+    print(f"✅ {n} servidores verificados.")
@@ -0,0 +1,91 @@
+"""
+toon.py - Montagem do TOON de um tópico a partir do histórico local
+O histórico local do tópico (ver cursores em config.py) guarda as mensagens cruas, um registro
+JSON [autor, conteudo, anexos] por linha, acumulado a cada busca. Aqui o cabeçalho é gerado e
+as linhas TOON são renderizadas em blocos direto para o pacote. Só usa a biblioteca padrão:
+roda no processo de empacotamento, e o processo do bot só busca e envia.
+"""
+import os
+import json
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.bmp')
+
+
+def formatar_linha(autor: str, conteudo: str, anexos: list) -> str:
+    txt = conteudo.replace('\n', ' ')
+    anexos_formatados = []
+    for a in anexos:
+        is_img = any(ext in a.lower() for ext in IMAGE_EXTENSIONS)
+        tag = "IMAGEM" if is_img else "ARQUIVO"
+        anexos_formatados.append(f"[{tag}: {a}]")
+    anexos_str = " ".join(anexos_formatados)
+    full = f"{txt} {anexos_str}".strip()
+    # Modificado: Retirado m['timestamp_brt'] da string final
+    return f"  {autor}, {full}"
+
+def registro(autor: str, conteudo: str, anexos: list) -> bytes:
+    """Linha do histórico local para uma mensagem"""
+    return (json.dumps([autor, conteudo, anexos], ensure_ascii=False) + "\n").encode("utf-8")
+
+def cabecalho(contexto: dict, mensagens: int) -> bytes:
+    lines = ["contexto:"] + [f"  {k}: {v}" for k, v in contexto.items()]
+    lines.append(f"mensagens[{mensagens}]{{autor,mensagem}}:")
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class ToonHistorico:
+    """
+    Origem de uma entrada do pacote (archive.py): cabeçalho + as linhas TOON dos primeiros
+    `tamanho` bytes do histórico local, sem a quebra de linha final. Só guarda caminho e
+    tamanhos, então atravessa processos; registros gravados depois da coleta ficam de fora.
+    """
+
+    def __init__(self, contexto: dict, historico: str, tamanho: int, mensagens: int):
+        self.contexto = contexto
+        self.historico = os.path.abspath(historico)
+        self.tamanho = tamanho
+        self.mensagens = mensagens
+        self._renderizado = None  # Tamanho do TOON, calculado no primeiro size()
+
+    def _blocos(self):
+        """Cabeçalho e linhas TOON, em ordem"""
+        yield cabecalho(self.contexto, self.mensagens)
+        lidos = 0
+        with open(self.historico, "rb") as f:
+            for raw in f:
+                lidos += len(raw)
+                if lidos > self.tamanho: break
+                line = formatar_linha(*json.loads(raw)).encode("utf-8")
+                yield line if lidos == self.tamanho else line + b"\n"
+
+    def size(self) -> int:
+        if self._renderizado is None:
+            self._renderizado = sum(len(b) for b in self._blocos())
+        return self._renderizado
+
+    def open(self):
+        return _Leitor(self._blocos())
+
+
+class _Leitor:
+    """Arquivo de leitura (read/close) sobre os blocos renderizados"""
+
+    def __init__(self, blocos):
+        self._blocos = blocos
+        self._buffer = b""
+
+    def read(self, n: int = -1) -> bytes:
+        """Sempre n bytes, exceto no fim (o tarfile não aceita leituras curtas)"""
+        partes = [self._buffer]
+        tamanho = len(self._buffer)
+        for bloco in self._blocos:
+            partes.append(bloco)
+            tamanho += len(bloco)
+            if n is not None and 0 <= n <= tamanho: break
+        data = b"".join(partes)
+        if n is None or n < 0: n = len(data)
+        self._buffer = data[n:]
+        return data[:n]
+
+    def close(self) -> None:
+        self._blocos.close()
@@ -104,7 +104,7 @@ class ExtractionChannelSelectView(BaseView):
             await interaction.response.send_message("Nenhum canal válido.", ephemeral=True)
             return
 
-        from extraction import perform_extraction_guild
+        from extraction import EXTRACTION_QUEUE, enviar_volumes
         await interaction.response.defer()
         
         ch = self.bot.get_channel(int(selected_id))
@@ -112,14 +112,11 @@ class ExtractionChannelSelectView(BaseView):
              await interaction.followup.send(f"❌ Erro: O canal ID {selected_id} não foi encontrado.", ephemeral=True)
              return
 
-        stats, zip_path = await perform_extraction_guild(self.bot, self.guild_id, target_channels=[ch])
-        
-        if zip_path:
-            await interaction.followup.send(f"📦 **Backup Manual: {ch.name}**\nForam extraídos {stats['topicos']} tópicos.", file=discord.File(zip_path))
-            import os
-            os.remove(zip_path)
-        else:
-            await interaction.followup.send(f"✅ **{ch.name}**: Nenhum tópico novo ou resolvido para extrair.")
+        async with EXTRACTION_QUEUE.extrair(self.bot, self.guild_id, target_channels=[ch]) as job:
+            if job.volumes:
+                await enviar_volumes(interaction.followup.send, f"📦 **Backup Manual: {ch.name}**\nForam extraídos {job.stats['topicos']} tópicos.", job)
+            else:
+                await interaction.followup.send(f"✅ **{ch.name}**: Nenhum tópico novo ou resolvido para extrair.")
 
 # --- SETUP INICIAL (ATUALIZADO) ---
 class PainelSetup(ui.View):
@@ -605,7 +602,7 @@ class PainelPrincipal(BaseView):
 
     @ui.button(label="Forçar Backup", style=discord.ButtonStyle.primary, row=1, emoji="💾")
     async def btn_backup(self, interaction: discord.Interaction, button: ui.Button):
-        from extraction import perform_extraction_guild
+        from extraction import EXTRACTION_QUEUE, enviar_volumes
         
         now = datetime.now().timestamp()
         if now - self.last_backup_click < 30:
@@ -616,10 +613,10 @@ class PainelPrincipal(BaseView):
         await interaction.response.defer(ephemeral=True)
         
         try:
-            stats, zip_p = await perform_extraction_guild(self.bot, self.guild_id)
-            msg = f"✅ **Backup Manual!** Novos: {stats['topicos']}"
-            if zip_p: await interaction.followup.send(msg, file=discord.File(zip_p), ephemeral=True)
-            else: await interaction.followup.send(msg + "\n(Sem arquivos novos)", ephemeral=True)
+            async with EXTRACTION_QUEUE.extrair(self.bot, self.guild_id) as job:
+                msg = f"✅ **Backup Manual!** Novos: {job.stats['topicos']}"
+                if job.volumes: await enviar_volumes(interaction.followup.send, msg, job, ephemeral=True)
+                else: await interaction.followup.send(msg + "\n(Sem arquivos novos)", ephemeral=True)
         except Exception as e:
             await interaction.followup.send(f"❌ Erro: {e}", ephemeral=True)
 